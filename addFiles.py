@@ -1,139 +1,274 @@
-import os
+import argparse
+import logging
+import tempfile
+import time
 
-from github import Github
+from cloneRepositories import CONFIG_PATH, LIGHT_GREEN, LIGHT_RED, LOG_FILE_PATH, MAX_WORKERS, WHITE, RepoWorkerPool, get_repos, opener, read_config_raw
+from githubApi import GithubApi, GithubApiError, RepoRecord
+from gitRunner import GitError, run_git
 from pathlib import Path
+from threading import Lock
 """
 This script is meant to be used to copy files from a directory into all the
 student's githubs. In order to be used you must specify the directory which
-has the files (that's in the same location as the script is being used, using
-full paths will result in some less than stellar results), and the path to 
-follow in the github repo. Basically, give the program what it asks for.
+has the files (relative to where the script is being used or a full path),
+and the path to follow in the github repo. Basically, give the program what it asks for.
+
+The folder is turned into git objects once and added on top of each student's
+latest commit with git plumbing, so nothing is checked out and no command is
+run per file. Repos are pushed to in parallel and failed pushes are retried.
 
 @author Trey Pachucki ttp2542@g.rit.edu
 """
 FILENAME = 'temp.txt'
-GITHUB_LINK = 'https://github.com/'
+PUSH_RETRIES = 2 # Extra attempts for repos whose push failed (override with --retries)
+PUSH_RETRY_DELAY = 2 # Seconds before the first retry, doubles every retry
 
 def main():
+    args = parse_args()
+    # Create log file
+    logging.basicConfig(level=logging.INFO, filename=LOG_FILE_PATH)
+
     # if this script has been run before use the past information
     try:
-        file = open('temp.txt', 'r')
+        file = open(FILENAME, 'r')
         token = file.readline()
         organization = file.readline()
+        file.close()
 
-    # otherwise get the information from the user
+    # then the token and organization cloneRepositories.py saved, so batch runs aren't asked anything
     except FileNotFoundError:
-        file = open('temp.txt', 'w')
-        token = input("Please input your Github Authentication Token: ")
-        organization = input("Please input the organization name: ")
-
-        # write to the file for future ease of use
-        file.write(token)
-        file.write('\n')
-        file.write(organization)
+        if opener(CONFIG_PATH):
+            token, organization = read_config_raw()[:2]
 
-    file.close()
-
-    # logs into github using the token
-    gh = Github(token.strip())
+        # otherwise get the information from the user
+        else:
+            file = open(FILENAME, 'w')
+            token = input("Please input your Github Authentication Token: ")
+            organization = input("Please input the organization name: ")
 
-    #creates the Github link with the organization
-    github_link = GITHUB_LINK + organization.strip() + '/'
+            # write to the file for future ease of use
+            file.write(token)
+            file.write('\n')
+            file.write(organization)
+            file.close()
 
     # the name of the assignment to get
-    assignment_name = input("Please input the assignment name: ")
+    assignment_name = args.assignment if args.assignment is not None else input("Please input the assignment name: ")
 
     # the name of the folder from which files are copied
-    start_folder = input("Please input the name of the folder with files: ")
+    start_folder = args.folder if args.folder is not None else input("Please input the name of the folder with files: ")
 
     # the destination folder for the files
-    ending_path = input("Please input the path to the folder in github: ")
+    ending_path = args.path if args.path is not None else input("Please input the path to the folder in github: ")
 
     # the commit message
-    commit_msg = input("Please specify the commit message: ")
+    commit_msg = args.message if args.message is not None else input("Please specify the commit message: ")
 
-    # gets the name of all the student repos ie 'assignment-username'
-    repo_list = get_repos(assignment_name, gh)
+    try:
+        # gets all the student repos of the organization ie 'assignment-username' (cached listing, see githubApi)
+        repo_list = get_repos(assignment_name, GithubApi(token).list_org_repos(organization.strip()))
+    except GithubApiError as e:
+        print(f'{LIGHT_RED}{e}{WHITE}')
+        return
+    print(f'Found {len(repo_list)} repos for {assignment_name}')
 
-    # creates the path for the assignment a string of the path
-    initial_path = Path.cwd() / assignment_name
+    # the folder with all the files
+    init_folder_path = Path.cwd() / start_folder
 
-    # makes a folder for the assignment as a whole
-    initial_path.mkdir()
+    # the folder's files are hashed once into a scratch repo, then for every student
+    # their latest commit is fetched, the files are added on top of it and it's pushed
+    with tempfile.TemporaryDirectory() as work_path:
+        injector = FileInjector(init_folder_path, ending_path, commit_msg, Path(work_path))
+        results = push_all(injector, repo_list, args.workers, args.retries)
+    print_results(results)
 
-    # change into the folder to get all the files
-    init_folder_path = Path.cwd() / start_folder
 
-    print(repo_list)
-    # creates a folder, clones the repository, then checks out to before a date
-    # the folder created is within the first folder made above, so all assignments
-    # are in one convenient folder
-    for repo in repo_list:
-        path = initial_path / repo.name
-        path.mkdir()
-
-        os.system('git clone ' + github_link + repo.name + ' ' + str(path))
-        end_path = ""
-        if ending_path != "":
-            end_path = path / end_path
-            # makes the path in the repository
-            end_path.mkdir()
-        else:
-            end_path = path
-           
-        
+def parse_args(args: list = None) -> argparse.Namespace:
+    '''
+    Parse command line options. Anything not given here is asked for
+    '''
+    parser = argparse.ArgumentParser(description='Add the files of a folder to every student repo of an assignment.')
+    parser.add_argument('-w', '--workers', type=int, default=MAX_WORKERS, help=f'number of repos pushed to at the same time (default: {MAX_WORKERS})')
+    parser.add_argument('--retries', type=int, default=PUSH_RETRIES, help=f'extra attempts for repos that failed (default: {PUSH_RETRIES})')
+    parser.add_argument('-a', '--assignment', help='assignment name (repo prefix) instead of asking for it')
+    parser.add_argument('-f', '--folder', help='folder with the files to add instead of asking for it')
+    parser.add_argument('-p', '--path', metavar='REPO_PATH', help='folder in the repos the files go in ("" for the top of the repo) instead of asking for it')
+    parser.add_argument('-m', '--message', help='commit message instead of asking for it. With all four given nothing is asked')
+    return parser.parse_args(args)
 
-        # processes folder
-        process(init_folder_path, end_path)
 
-        # commits and pushes the stuff
-        os.chdir(end_path)
-        os.system('git commit -m "' + commit_msg + '"')
-        os.system('git push')
+class PushResults:
+    '''
+    Outcome of every repo of a run. Shared by all PushHandlers so updates are locked
+    '''
+    __slots__ = ['__lock', '__results']
 
 
-"""
-This function gets the repos for the specific assignment
-"""
-def get_repos(assignment_name, github):
-    repo_list = []
-    for repo in github.get_user().get_repos():
-        if assignment_name in repo.name:
-            repo_list.append(repo)
+    def __init__(self):
+        self.__lock = Lock()
+        self.__results = dict() # repo name -> (outcome, attempts, error message)
 
-    return repo_list
 
+    def add(self, name: str, outcome: str, message: str = ''):
+        '''
+        Records one attempt for a repo, outcome is one of `pushed`, `up to date` or `failed`
+        '''
+        with self.__lock:
+            attempts = self.__results[name][1] + 1 if name in self.__results else 1
+            self.__results[name] = (outcome, attempts, message)
 
-"""
-This processes the folders (ie copies the files and adds them via git
-"""
-def process(item_path, target_directory):
-    # if it's a directory go through the items in it and process them
-    if os.path.isdir(item_path):
-        os.chdir(item_path)
-        ls = os.listdir(item_path)
-        name_of_directory = str(item_path).split("\\")
-        name_of_directory = name_of_directory[len(name_of_directory) - 1]
-        new_dir = target_directory / name_of_directory
-        new_dir.mkdir()
-        for item in ls:
-            temp_path = item_path / item
-            process(temp_path, new_dir)
-
-    # if not, copy it into the file structure and add it to git
-    else:
-        # these print statements are technically lava flow, but useful for
-        # debugging purposes
-
-        # print("Item_path: " + item_path)
-        # print("Target Directory: " + target_directory)
-
-        # copies file and adds them to Git
-        os.system("copy " + str(item_path) + " " + str(target_directory))
-        item_name = str(item_path).split("\\")
-        item_name = item_name[len(item_name) - 1]
-        os.chdir(target_directory)
-        os.system('git add ' + item_name)
-
-
-main()
+
+    def failed(self) -> list:
+        '''
+        Returns the names of the repos whose last attempt failed
+        '''
+        return [name for name, (outcome, _, _) in self.__results.items() if outcome == 'failed']
+
+
+    def items(self) -> list:
+        '''
+        Returns (name, (outcome, attempts, error message)) for every repo, sorted by name
+        '''
+        return sorted(self.__results.items())
+
+
+class PushHandler:
+    '''
+    A job that adds the files to one repo and pushes it. Jobs are run by a RepoWorkerPool
+    '''
+    __slots__ = ['__repo', '__injector', '__results']
+
+
+    def __init__(self, repo: RepoRecord, injector: 'FileInjector', results: PushResults):
+        self.__repo = repo
+        self.__injector = injector
+        self.__results = results
+
+
+    def run(self):
+        try:
+            if self.__injector.inject(self.__repo.name, self.__repo.clone_url, self.__repo.default_branch):
+                self.__results.add(self.__repo.name, 'pushed')
+                print(f'  > Pushed files to {self.__repo.name}')
+            else:
+                self.__results.add(self.__repo.name, 'up to date')
+        except Exception as e: # git failed, or the scratch repo couldn't be written: the repo shows as failed and is retried
+            self.__results.add(self.__repo.name, 'failed', str(e) or type(e).__name__)
+            print(f'  > {LIGHT_RED}Could not add files to {self.__repo.name}{WHITE}')
+            logging.exception(f'Could not add files to {self.__repo.name}:')
+
+
+def push_all(injector: 'FileInjector', repos: list, num_workers: int, retries: int) -> PushResults:
+    '''
+    Pushes the files to every repo with num_workers at a time, then retries only the repos that failed
+    (e.g. the push was rejected because the student pushed in the meantime) up to retries more times,
+    waiting PUSH_RETRY_DELAY seconds then twice as long every time
+    '''
+    results = PushResults()
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            failed = set(results.failed())
+            repos = [repo for repo in repos if repo.name in failed and repo.default_branch]
+            if not repos:
+                break
+            delay = PUSH_RETRY_DELAY * 2 ** (attempt - 1)
+            print(f'Retrying {len(repos)} failed repos in {delay}s (attempt {attempt + 1}/{retries + 1})')
+            time.sleep(delay)
+
+        pool = RepoWorkerPool(num_workers)
+        for repo in repos:
+            if repo.default_branch:
+                pool.submit(PushHandler(repo, injector, results))
+            else: # empty repos have nothing to add on top of
+                results.add(repo.name, 'failed', 'repo is empty')
+        pool.shutdown()
+    return results
+
+
+def print_results(results: PushResults):
+    '''
+    Prints a table with the outcome of every repo and a total
+    '''
+    items = results.items()
+    width = max([len(name) for name, _ in items] + [len('Repo')])
+    print()
+    print(f'{"Repo":<{width}}  {"Result":<10}  Attempts')
+    for name, (outcome, attempts, message) in items:
+        color = LIGHT_RED if outcome == 'failed' else LIGHT_GREEN
+        print(f'{name:<{width}}  {color}{outcome:<10}{WHITE}  {attempts}' + (f'  {message}' if message else ''))
+    print()
+    print(f'{len(items) - len(results.failed())}/{len(items)} repos have the files.')
+
+
+class FileInjector:
+    """
+    Adds the files of a folder to student repos without cloning them.
+
+    The folder is hashed into a scratch repo once. Each student repo gets its own small scratch repo
+    that borrows those objects, fetches only the student's latest commit, builds the new tree in a
+    temporary index and pushes a commit made with commit-tree.
+    """
+    __slots__ = ['__work_path', '__source_repo', '__entries', '__commit_msg']
+
+
+    def __init__(self, source_folder: Path, ending_path: str, commit_msg: str, work_path: Path):
+        self.__work_path = work_path
+        self.__source_repo = work_path / 'source.git'
+        self.__commit_msg = commit_msg
+        run_git(['init', '--bare', '-q', str(self.__source_repo)])
+        # the folder itself is copied, so its files go in <ending_path>/<folder name>/ in the repo
+        prefix = '/'.join(part for part in ending_path.replace('\\', '/').split('/') + [source_folder.name] if part)
+        self.__entries = self.hash_folder(source_folder, prefix)
+
+
+    def hash_folder(self, source_folder: Path, prefix: str) -> bytes:
+        """
+        Writes every file of the folder into the source repo's objects (one git add for the whole folder)
+        and returns them as `git update-index -z --index-info` input with paths under prefix
+        """
+        env = {'GIT_INDEX_FILE': str(self.__work_path / 'source.index')}
+        run_git(['--git-dir', str(self.__source_repo), '--work-tree', str(source_folder), 'add', '--all', '--force', '.'], env=env)
+        tree = run_git(['--git-dir', str(self.__source_repo), 'write-tree'], env=env).stdout.strip()
+        listing = run_git(['--git-dir', str(self.__source_repo), 'ls-tree', '-r', '-z', tree]).stdout
+
+        entries = []
+        for entry in listing.split('\0'):
+            if entry: # `<mode> blob <sha>\t<path>`
+                info, path = entry.split('\t', 1)
+                mode, _, sha = info.split(' ')
+                entries.append(f'{mode} {sha}\t{prefix}/{path}\0')
+        return ''.join(entries).encode()
+
+
+    def inject(self, name: str, url: str, branch: str) -> bool:
+        """
+        Adds the files on top of the latest commit of branch in the repo at url and pushes it.
+        Returns False if the repo already had the exact files (nothing pushed). Raises GitError if a step fails
+        """
+        repo = self.__work_path / f'{name}.git'
+        git_dir = ['--git-dir', str(repo)]
+        env = {'GIT_INDEX_FILE': str(self.__work_path / f'{name}.index')}
+        run_git(['init', '--bare', '-q', str(repo)])
+        with open(repo / 'objects' / 'info' / 'alternates', 'w') as alternates: # borrow the folder's objects
+            alternates.write(str((self.__source_repo / 'objects').resolve()))
+
+        # only the latest commit is needed, its parents are already on github
+        run_git(git_dir + ['fetch', '-q', '--depth=1', url, f'+refs/heads/{branch}:refs/heads/{branch}'])
+        head, head_tree = run_git(git_dir + ['rev-parse', f'refs/heads/{branch}', f'refs/heads/{branch}^{{tree}}']).stdout.split()
+
+        # student's files + the folder's files (replacing files with the same path)
+        run_git(git_dir + ['read-tree', head], env=env)
+        run_git(git_dir + ['update-index', '--add', '-z', '--index-info'], input=self.__entries, env=env)
+        tree = run_git(git_dir + ['write-tree'], env=env).stdout.strip()
+        if tree == head_tree:
+            return False
+
+        commit = run_git(git_dir + ['commit-tree', tree, '-p', head, '-m', self.__commit_msg]).stdout.strip()
+        run_git(git_dir + ['update-ref', f'refs/heads/{branch}', commit, head])
+        run_git(git_dir + ['push', '-q', url, f'refs/heads/{branch}:refs/heads/{branch}'])
+        return True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+python benchmark.py %*
+pause
\ No newline at end of file
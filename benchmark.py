@@ -0,0 +1,468 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from datetime import datetime, timedelta, timezone
+from gitRunner import run_git
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+'''
+Offline end to end benchmark of the grading scripts.
+
+Makes a fake organization of N local bare repos (same starter code, a configurable number of commits
+around a due date), serves it through a local stand-in for the Github REST/GraphQL API with file:// clone
+URLs, then times cloneRepositories.py, changeCommit.py and linesBetweenCommits.py on it exactly as a user
+would run them. Results are appended to tmp/benchmark/results.jsonl and compared with the last run.
+
+Usage: python benchmark.py [-n 10 100 1000] [--commits 20] [-w 16] [-e async]
+'''
+SCRIPTS_PATH = Path(__file__).resolve().parent
+BENCHMARK_PATH = 'tmp/benchmark' # Fixtures, outputs and results
+RESULTS_FILENAME = 'results.jsonl' # One line per timed step of every run
+ORGANIZATION = 'benchmark-org'
+ASSIGNMENT_NAME = 'hw1'
+DUE_DATE = datetime(2022, 2, 1, 23, 59) # Commits are spread around it, local time like the scripts use
+COMMIT_WINDOW = (timedelta(days=7), timedelta(days=1)) # Student commits start this long before the due date and end this long after
+STEPS = ('clone', 'clone_stats', 'change_commit', 'lines_between', 'snapshot', 'rate_limits') # snapshot late, it replaces the clones the others use
+RATE_LIMIT_MODES = ('primary', 'retry_after', 'secondary', 'rotation') # how the fake API limits the rate_limits step's pulls, one pull each
+RATE_LIMIT_WAIT = 3 # Seconds the fake API's limits last (reset, Retry-After, secondary back-off)
+RATE_LIMIT_BUDGET = 3 # Requests the primary mode allows before its reset
+SPARE_TOKEN = 'benchmark-spare' # Second token of the rotation mode, the first one is out of requests
+
+
+def main():
+    args = parse_args()
+    work_path = Path(args.work_dir).resolve()
+    results_file = work_path / RESULTS_FILENAME
+    previous = read_previous_results(results_file)
+    run_id = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    revision = run_git(['rev-parse', '--short', 'HEAD'], cwd=SCRIPTS_PATH, check=False).stdout.strip() or None
+
+    rows = []
+    for num_repos in args.num_repos:
+        fixture_path = work_path / f'org-{num_repos}-{args.commits}-{args.files}-{args.file_size}'
+        repos = make_organization(fixture_path / 'repos', num_repos, args.commits, args.files, args.file_size)
+
+        rate_limit = dict() # set by the rate_limits step, read by the fake API
+        server = ThreadingHTTPServer(('127.0.0.1', 0), make_api_handler(repos, rate_limit))
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            for step in args.steps:
+                seconds, ok = run_step(step, fixture_path, f'http://127.0.0.1:{server.server_port}', args.workers, args.engine, rate_limit)
+                result = {'run': run_id, 'revision': revision, 'repos': num_repos, 'commits': args.commits, 'files': args.files,
+                          'file_size': args.file_size, 'workers': args.workers, 'engine': args.engine, 'step': step, 'seconds': round(seconds, 3), 'ok': ok}
+                rows.append(result)
+                print_row(result, previous.get(result_key(result)))
+        finally:
+            server.shutdown()
+
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_file, 'a') as f_handle:
+        for result in rows:
+            f_handle.write(json.dumps(result) + '\n')
+    print(f'Results saved to `{results_file}`.')
+
+
+def parse_args(args: list = None) -> argparse.Namespace:
+    '''
+    Parse command line options
+    '''
+    parser = argparse.ArgumentParser(description='Time the grading scripts against a generated local organization.')
+    parser.add_argument('-n', '--num-repos', type=int, nargs='+', default=[10, 100, 1000], help='organization sizes to time (default: 10 100 1000)')
+    parser.add_argument('--commits', type=int, default=20, help='student commits per repo (default: 20)')
+    parser.add_argument('--files', type=int, default=20, help='starter code files per repo (default: 20)')
+    parser.add_argument('--file-size', type=int, default=4096, help='bytes per starter code file (default: 4096)')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='passed on as --workers to the scripts (default: their own default)')
+    parser.add_argument('-e', '--engine', choices=['threads', 'async'], default='threads', help='passed on as --engine to cloneRepositories.py (default: threads)')
+    parser.add_argument('--steps', nargs='+', choices=STEPS, default=list(STEPS), help='steps to time, in order (default: all)')
+    parser.add_argument('--work-dir', default=BENCHMARK_PATH, help=f'where fixtures, outputs and results go (default: {BENCHMARK_PATH})')
+    return parser.parse_args(args)
+
+
+def make_organization(repos_path: Path, num_repos: int, num_commits: int, num_files: int, file_size: int) -> list:
+    '''
+    Creates num_repos bare repos `<ASSIGNMENT_NAME>-student<i>.git` in repos_path, skipping ones made by an earlier run.
+    Every repo starts with the same starter code commit followed by num_commits student commits around the due date.
+    Returns the metadata the fake API serves for them
+    '''
+    repos_path.mkdir(parents=True, exist_ok=True)
+    created = int((DUE_DATE - COMMIT_WINDOW[0] - timedelta(days=1)).timestamp())
+    repos = []
+    made = 0
+    for i in range(num_repos):
+        name = f'{ASSIGNMENT_NAME}-student{i:04d}'
+        repo_path = repos_path / f'{name}.git'
+        if not Path.is_file(repo_path / 'benchmark-done'): # marker written last, half made repos are made again
+            shutil.rmtree(repo_path, ignore_errors=True)
+            run_git(['init', '--bare', '-q', '--initial-branch=main', str(repo_path)])
+            run_git(['fast-import', '--quiet'], cwd=repo_path, input=make_history(i, created, num_commits, num_files, file_size))
+            Path(repo_path / 'benchmark-done').touch()
+            made += 1
+        repos.append({
+            'name': name,
+            'url': repo_path.as_uri()[:-len('.git')], # the API adds .git back to make the clone url
+            'path': repo_path,
+            'created': created,
+            'commits': num_commits + 1,
+        })
+    if made:
+        print(f'Made {made} repos in `{repos_path}`.')
+    return repos
+
+
+def make_history(student: int, created: int, num_commits: int, num_files: int, file_size: int) -> bytes:
+    '''
+    Returns a `git fast-import` stream with the starter code commit and the student's commits
+    '''
+    stream = []
+    def add_data(data: bytes):
+        stream.append(f'data {len(data)}\n'.encode())
+        stream.append(data)
+        stream.append(b'\n')
+
+    # starter code, identical in every repo like a Github Classroom template
+    stream.append(f'commit refs/heads/main\ncommitter Github Classroom <classroom@example.com> {created} +0000\n'.encode())
+    add_data(b'Initial commit')
+    for file_number in range(num_files):
+        line = f'# starter file {file_number}\n'.encode()
+        stream.append(f'M 100644 inline src/starter{file_number}.py\n'.encode())
+        add_data((line * (file_size // len(line) + 1))[:file_size])
+    # a link and (where git can check it out) a name with a colon, snapshots have to make both like a clone
+    stream.append(b'M 120000 inline docs/main.py\n')
+    add_data(b'../src/main.py')
+    if os.name != 'nt':
+        stream.append(b'M 100644 inline docs/week 1: setup.txt\n')
+        add_data(b'Install python and git\n')
+
+    # student commits evenly spread over the commit window, the last ones are after the due date
+    start = (DUE_DATE - COMMIT_WINDOW[0]).timestamp()
+    step = (COMMIT_WINDOW[0] + COMMIT_WINDOW[1]).total_seconds() / max(1, num_commits)
+    lines = []
+    for commit_number in range(num_commits):
+        lines.append(f'print("student {student} commit {commit_number}")\n')
+        stream.append(f'commit refs/heads/main\ncommitter Student {student} <student{student}@example.com> {int(start + step * commit_number)} +0000\n'.encode())
+        add_data(f'Commit {commit_number}'.encode())
+        stream.append(b'M 100644 inline src/main.py\n')
+        add_data(''.join(lines).encode())
+    return b''.join(stream)
+
+
+def make_api_handler(repos: list, rate_limit: dict = None) -> type:
+    '''
+    Returns a request handler class answering the Github API requests the scripts make for repos:
+    the REST org repo listing (paginated, with ETags), the batched GraphQL repo and due date commit lookups
+    and the tarball of a commit (redirected to a download path like Github does).
+    While rate_limit has a `mode` (one of RATE_LIMIT_MODES) and its `until` time isn't reached, API requests are limited like Github does
+    and what the client did is written back to it (`tokens` used, `limited_at`, `resumed_after`, `last_request`)
+    '''
+    by_name = {repo['name']: repo for repo in repos}
+    rate_limit = rate_limit if rate_limit is not None else dict()
+    lock = Lock() # the server answers requests on several threads
+
+    class ApiHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status: int, body, headers: dict = None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in getattr(self, 'rate_limit_headers', {'X-RateLimit-Remaining': '5000'}).items():
+                self.send_header(key, value)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_rate_limited(self) -> bool:
+            '''
+            Answers the request with a rate limit error if the current mode says to, returns whether it did
+            '''
+            token = self.headers.get('Authorization', '').split(' ')[-1]
+            now = time.time()
+            error = None
+            with lock:
+                self.rate_limit_headers = {'X-RateLimit-Remaining': '5000'}
+                mode = rate_limit.get('mode')
+                if mode:
+                    rate_limit['last_request'] = now
+                if not mode or now >= rate_limit['until']:
+                    return False
+                rate_limit['tokens'].add(token)
+                reset = {'X-RateLimit-Reset': str(int(rate_limit['until']) + 1)}
+                if mode == 'primary': # a few requests left until the reset, then 403s
+                    rate_limit['left'] -= 1
+                    self.rate_limit_headers = {'X-RateLimit-Remaining': str(max(0, rate_limit['left'])), **reset}
+                    if rate_limit['left'] < 0:
+                        rate_limit['rejected'] = rate_limit.get('rejected', 0) + 1
+                        error = (403, 'API rate limit exceeded')
+                elif mode == 'rotation': # the first token is out of requests, the spare one isn't
+                    if token != SPARE_TOKEN:
+                        self.rate_limit_headers = {'X-RateLimit-Remaining': '0', **reset}
+                        error = (403, 'API rate limit exceeded')
+                elif 'limited_at' not in rate_limit: # only the first request hits the secondary limit
+                    self.rate_limit_headers = {'X-RateLimit-Remaining': '4000', **({'Retry-After': str(RATE_LIMIT_WAIT)} if mode == 'retry_after' else {})}
+                    error = (429, 'Too many requests') if mode == 'retry_after' else (403, 'You have exceeded a secondary rate limit')
+                if error and 'limited_at' not in rate_limit:
+                    rate_limit['limited_at'] = now
+                elif not error and 'limited_at' in rate_limit and 'resumed_after' not in rate_limit:
+                    rate_limit['resumed_after'] = now - rate_limit['limited_at']
+            if error:
+                self.send_json(error[0], {'message': error[1]})
+            return bool(error)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip('/').split('/')
+            if parts[:1] != ['codeload'] and self.send_rate_limited(): # the download host isn't rate limited
+                return
+            if parts[:2] == ['repos', ORGANIZATION] and len(parts) >= 4 and parts[2] in by_name:
+                self.send_repo_file(by_name[parts[2]], parts[3:])
+                return
+            if parts[:1] == ['codeload'] and len(parts) == 3 and parts[1] in by_name:
+                self.send_tarball(by_name[parts[1]], parts[2])
+                return
+            if url.path != f'/orgs/{ORGANIZATION}/repos':
+                self.send_json(404, {'message': 'Not Found'})
+                return
+            query = parse_qs(url.query)
+            per_page = int(query.get('per_page', ['30'])[0])
+            page = int(query.get('page', ['1'])[0])
+            listing = repos[(page - 1) * per_page:page * per_page]
+            etag = f'"{len(repos)}-{page}-{per_page}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            headers = {'ETag': etag}
+            if page * per_page < len(repos):
+                headers['Link'] = f'<{url.path}?page={page + 1}>; rel="next"'
+            self.send_json(200, [{
+                'name': repo['name'],
+                'clone_url': f'{repo["url"]}.git',
+                'created_at': format_timestamp(repo['created']),
+                'pushed_at': format_timestamp(repo['created']),
+                'default_branch': 'main',
+                'size': 1,
+            } for repo in listing], headers)
+
+        def send_repo_file(self, repo: dict, parts: list):
+            if len(parts) == 2 and parts[0] == 'tarball':
+                self.send_response(302)
+                self.send_header('Location', f'/codeload/{repo["name"]}/{parts[1]}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self.send_json(404, {'message': 'Not Found'})
+
+        def send_tarball(self, repo: dict, sha: str):
+            prefix = f'{ORGANIZATION}-{repo["name"]}-{sha[:7]}/' # Github's top folder
+            archive = subprocess.run(['git', 'archive', '--format=tar.gz', f'--prefix={prefix}', sha], cwd=repo['path'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            if archive.returncode != 0:
+                self.send_json(404, {'message': 'Not Found'})
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-gzip')
+            self.send_header('Content-Length', str(len(archive.stdout)))
+            self.end_headers()
+            self.wfile.write(archive.stdout)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if self.send_rate_limited():
+                return
+            data = dict()
+            until = request['variables'].get('until') # set when asking for the commit at a due date
+            for alias, name in request['variables'].items():
+                if alias in ('owner', 'until'):
+                    continue
+                repo = by_name.get(name)
+                if until:
+                    sha = repo and run_git(['rev-list', '-n', '1', f'--before={until}', 'main'], cwd=repo['path'], check=False).stdout.strip()
+                    data[f'r{alias[1:]}'] = repo and {'name': repo['name'], 'defaultBranchRef': {'target': {'history': {'nodes': [{'oid': sha}] if sha else []}}}}
+                    continue
+                data[f'r{alias[1:]}'] = repo and {
+                    'name': repo['name'],
+                    'url': repo['url'],
+                    'createdAt': format_timestamp(repo['created']),
+                    'pushedAt': format_timestamp(repo['created']),
+                    'diskUsage': 1,
+                    'templateRepository': None,
+                    'defaultBranchRef': {'name': 'main', 'target': {'history': {'totalCount': repo['commits']}}},
+                }
+            self.send_json(200, {'data': data})
+
+    return ApiHandler
+
+
+def format_timestamp(timestamp: int) -> str:
+    '''
+    Unix time to a Github ISO 8601 UTC timestamp
+    '''
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def run_step(step: str, fixture_path: Path, api_url: str, workers: int, engine: str, rate_limit: dict = None) -> tuple:
+    '''
+    Runs one script like a user would (answers piped to its prompts) against the fake organization.
+    Returns (seconds, whether the script finished). The snapshot step also has to download exactly the files a clone checks out
+    '''
+    if step == 'rate_limits':
+        return run_rate_limits(fixture_path, api_url, workers, engine, rate_limit)
+    output_path = fixture_path / 'output'
+    output_path.mkdir(exist_ok=True)
+    clone_path = output_path / f'{ASSIGNMENT_NAME}-clone' # what the snapshots are compared to
+    if step == 'snapshot':
+        shutil.rmtree(clone_path, ignore_errors=True)
+        _, cloned = run_step('clone', fixture_path, api_url, workers, engine) # not timed, the earlier steps moved the clones
+        if not cloned:
+            return (0, False)
+        os.rename(output_path / ASSIGNMENT_NAME, clone_path)
+    due_date = DUE_DATE.strftime('%Y-%m-%d')
+    due_time = DUE_DATE.strftime('%H:%M')
+    worker_args = ['--workers', str(workers)] if workers else []
+
+    if step in ('clone', 'clone_stats', 'snapshot'):
+        write_config(fixture_path, output_path, step == 'clone_stats')
+        shutil.rmtree(output_path / ASSIGNMENT_NAME, ignore_errors=True) # a fresh clone every time
+        command = ['cloneRepositories.py', *worker_args, '--engine', engine] + (['--snapshot'] if step == 'snapshot' else [])
+        answers = ['', ASSIGNMENT_NAME, due_date, due_time] # no class roster, assignment, due date, due time
+        cwd = fixture_path
+    elif step == 'change_commit':
+        write_config(fixture_path, output_path, False)
+        command = ['changeCommit.py', *worker_args]
+        earlier = DUE_DATE - timedelta(days=2) # moves every repo back a few commits
+        answers = ['', '', earlier.strftime('%Y-%m-%d'), earlier.strftime('%H:%M')] # no class roster, latest folder, due date, due time
+        cwd = fixture_path
+    else:
+        command = ['linesBetweenCommits.py', *worker_args]
+        answers = [ASSIGNMENT_NAME]
+        cwd = output_path
+
+    seconds, output, returncode = run_script(command, answers, cwd, api_url)
+    ok = returncode == 0 and ('Done.' in output or step == 'lines_between') and 'ERROR' not in output
+    if not ok:
+        print(f'`{step}` did not finish, last output:\n' + '\n'.join(output.strip().splitlines()[-10:]))
+    elif step == 'snapshot':
+        different = compare_folders(clone_path, output_path / ASSIGNMENT_NAME)
+        shutil.rmtree(clone_path)
+        if different:
+            print(f'`{step}` files differ from a clone in {len(different)} repos: {", ".join(different[:10])}')
+            ok = False
+    return (seconds, ok)
+
+
+def run_script(command: list, answers: list, cwd: Path, api_url: str, env: dict = None) -> tuple:
+    '''
+    Runs one of the scripts with answers piped to its prompts. Returns (seconds, output, return code)
+    '''
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, str(SCRIPTS_PATH / command[0]), *command[1:]], cwd=cwd, input='\n'.join(answers + ['']).encode(),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env={**os.environ, 'GITHUB_API_URL': api_url, **(env or {})})
+    return (time.perf_counter() - start, process.stdout.decode(errors='replace'), process.returncode)
+
+
+def run_rate_limits(fixture_path: Path, api_url: str, workers: int, engine: str, rate_limit: dict) -> tuple:
+    '''
+    Pulls the organization (--snapshot, so most of the time is API requests) once per RATE_LIMIT_MODES with the fake API limiting it.
+    Every pull has to finish, and wait like Github asks: until the reset (primary), for Retry-After or the back-off (secondary),
+    or not at all when a second token still has requests (rotation). Returns (seconds of all pulls, whether they all did)
+    '''
+    output_path = fixture_path / 'output'
+    output_path.mkdir(exist_ok=True)
+    worker_args = ['--workers', str(workers)] if workers else []
+    answers = ['', ASSIGNMENT_NAME, DUE_DATE.strftime('%Y-%m-%d'), DUE_DATE.strftime('%H:%M')] # no class roster, assignment, due date, due time
+    total = 0
+    ok = True
+    for mode in RATE_LIMIT_MODES:
+        write_config(fixture_path, output_path, False, f'benchmark,{SPARE_TOKEN}' if mode == 'rotation' else 'benchmark')
+        shutil.rmtree(output_path / ASSIGNMENT_NAME, ignore_errors=True)
+        rate_limit.clear()
+        rate_limit.update(mode=mode, tokens=set(), left=RATE_LIMIT_BUDGET, until=time.time() + (RATE_LIMIT_WAIT if mode == 'primary' else RATE_LIMIT_WAIT * 20)) # the other modes' limits don't reset on their own
+        # the secondary limit back-off is a minute by default, too long for a benchmark
+        seconds, output, returncode = run_script(['cloneRepositories.py', *worker_args, '--engine', engine, '--snapshot'], answers, fixture_path, api_url,
+                                                 {'GITHUB_SECONDARY_LIMIT_WAIT': str(RATE_LIMIT_WAIT)})
+        limits = dict(rate_limit)
+        rate_limit.clear()
+        total += seconds
+
+        problem = None
+        if returncode != 0 or 'Done.' not in output or 'ERROR' in output:
+            problem = 'did not finish, last output:\n' + '\n'.join(output.strip().splitlines()[-10:])
+        elif mode == 'primary' and (limits.get('last_request', 0) < limits['until'] or limits.get('rejected', 0) > 1):
+            problem = f'didn\'t wait for the reset ({limits.get("rejected", 0)} requests sent with none left)'
+        elif mode in ('retry_after', 'secondary') and limits.get('resumed_after', 0) < RATE_LIMIT_WAIT * 0.9:
+            problem = f'retried after {limits.get("resumed_after", 0):.1f}s instead of {RATE_LIMIT_WAIT}s'
+        elif mode == 'rotation' and (SPARE_TOKEN not in limits['tokens'] or seconds >= RATE_LIMIT_WAIT * 10):
+            problem = 'did not switch to the spare token'
+        if problem:
+            print(f'`rate_limits` ({mode}) {problem}')
+            ok = False
+    return (total, ok)
+
+
+def compare_folders(clone_path: Path, snapshot_path: Path) -> list:
+    '''
+    Returns the repo folders whose files (paths, bytes and link targets, .git left out) aren't the same in the clones and the snapshots
+    '''
+    def read_files(repo_path: Path) -> dict:
+        paths = [path for path in repo_path.rglob('*') if '.git' not in path.relative_to(repo_path).parts]
+        return {path.relative_to(repo_path).as_posix(): b'link to ' + os.readlink(path).encode() if path.is_symlink() else path.read_bytes() for path in paths if path.is_symlink() or path.is_file()}
+
+    repo_names = sorted({path.name for path in clone_path.iterdir() if path.is_dir()} | {path.name for path in snapshot_path.iterdir() if path.is_dir()})
+    return [name for name in repo_names if not (clone_path / name).is_dir() or not (snapshot_path / name).is_dir() or read_files(clone_path / name) != read_files(snapshot_path / name)]
+
+
+def write_config(fixture_path: Path, output_path: Path, repo_stats: bool, token: str = 'benchmark'):
+    '''
+    Writes the tmp/config.txt the scripts read, pointing at the fake organization
+    '''
+    config_path = fixture_path / 'tmp'
+    config_path.mkdir(exist_ok=True)
+    with open(config_path / 'config.txt', 'w') as config:
+        config.write(f'Token: {token}\nOrganization: {ORGANIZATION}\nSave Classroom Roster: False\nClassroom Roster Path: \n')
+        config.write(f'Output Directory: {output_path}\nGet average lines per repo: {repo_stats}\nAdd timestamp to folder: False')
+
+
+def result_key(result: dict) -> tuple:
+    '''
+    Results with the same key are comparable between runs
+    '''
+    return (result['repos'], result['commits'], result['files'], result['file_size'], result['workers'], result.get('engine', 'threads'), result['step'])
+
+
+def read_previous_results(results_file: Path) -> dict:
+    '''
+    Returns the latest earlier result of every key in the results file
+    '''
+    previous = dict()
+    if Path.is_file(results_file):
+        with open(results_file) as f_handle:
+            for line in f_handle:
+                result = json.loads(line)
+                if result['ok']:
+                    previous[result_key(result)] = result
+    return previous
+
+
+def print_row(result: dict, previous: dict):
+    '''
+    Prints one step's time and how it compares to the last run
+    '''
+    change = ''
+    if previous and previous['seconds'] > 0 and result['ok']:
+        percent = (result['seconds'] - previous['seconds']) / previous['seconds'] * 100
+        change = f' ({percent:+.0f}% vs {previous["revision"] or previous["run"]})'
+    status = '' if result['ok'] else ' FAILED'
+    print(f'{result["repos"]:>5} repos  {result["step"]:<14} {result["seconds"]:>8.2f}s{change}{status}')
+
+
+if __name__ == '__main__':
+    main()
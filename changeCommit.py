@@ -1,129 +1,140 @@
 from cloneRepositories import *
+from gitRunner import GitError, read_origin_head, read_ref, run_git
+from threading import Lock
 """
 This script changes the commit head of a previously cloned repository.
 
 @author Trey Pachucki ttp2542@g.rit.edu, Jin Moon jym2584@g.rit.edu, Kamron Cole kjc8084@rit.edu
 """
-from threading import Thread
-import _thread
 
-ROLLBACK_COUNT = 0 # keeping track of successful rollback of repos
 
-class RepoHandler(Thread):
+class RollbackResult:
     '''
-    A Thread that clones a repo, resets it to specific time, and gets average number of lines per commit
+    Counts what happened to every repo of a run. Shared by all RepoHandlers so updates are locked
+    '''
+    __slots__ = ['__lock', 'rolled_back', 'already_there', 'skipped', 'failed']
+
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.rolled_back = 0 # reset to the commit at the due date
+        self.already_there = 0 # HEAD was already at the commit, nothing to do
+        self.skipped = 0 # no commit before the due date or git couldn't read the repo
+        self.failed = 0 # git reset failed
 
-    Each thread only clones one repo.
+
+    def add(self, outcome: str):
+        '''
+        Counts one repo's outcome, one of `rolled_back`, `already_there`, `skipped` or `failed`
+        '''
+        with self.__lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+
+    def at_due_date(self) -> int:
+        '''
+        Returns the number of repos that ended up at the due date commit
+        '''
+        return self.rolled_back + self.already_there
+
+
+class RepoHandler:
+    '''
+    A job that resets an already cloned repo to specific time
+
+    Each job only rolls back one repo. Jobs are run by a RepoWorkerPool.
     '''
-    __slots___ = ['__folder_name', '__date_due', '__time_due', '__repo_path']
+    __slots___ = ['__folder_name', '__date_due', '__time_due', '__repo_path', '__result']
 
 
-    def __init__(self, folder_name: str, repo_path:str, date_due: str, time_due: str):
+    def __init__(self, folder_name: str, repo_path:str, date_due: str, time_due: str, result: RollbackResult):
         self.__folder_name = folder_name
         self.__repo_path = repo_path
         self.__date_due = date_due 
         self.__time_due = time_due
-        super().__init__()
+        self.__result = result # counts of the whole run
 
 
     def run(self):
         '''
-        Clones given repo and renames destination to student real name if class roster is provided.
+        Finds the commit at the due date and resets the repo to it unless it's already there
         '''
         try:            
 
-            commit_hash = self.get_commit_hash() # get commit hash at due date
-            self.rollback_repo(commit_hash) # rollback repo to commit hash
-            
-        except: # Catch exception raised and interrupt main thread
-            rev_list_process = subprocess.Popen(['git', 'log', '--reverse', '--date-order', '--date=local', '--max-parents=0' '--pretty="format=%ci (%s by %cn)"'], cwd=self.__repo_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            line = None
-
-            for line in iter(rev_list_process.stdout.readline, b'\n'): # b'\n'-separated lines
-                line = line.decode().strip() # line is read in bytes. Decode to str
+            with METRICS.phase('get_commit_hash', self.__folder_name):
+                commit_hash = self.get_commit_hash() # get commit hash at due date
+            if commit_hash == read_ref(self.__repo_path): # HEAD is already at the commit, skip the reset
+                self.__result.add('already_there')
+            else:
+                with METRICS.phase('rollback_repo', self.__folder_name):
+                    self.rollback_repo(commit_hash) # rollback repo to commit hash
             
-            if re.match(r'^error:|^warning:|^fatal:', line):
-                print(f'  > {LIGHT_RED}Skipping `{self.__folder_name}`\n\t{line}. {WHITE}') # print error to end user
+        except: # Catch exception raised and tell end user why the repo was skipped
+            self.__result.add('skipped')
+            oldest_commit = run_git(['log', '--max-parents=0', '--date=local', '--format=%cd (%s by %cn)'], cwd=self.__repo_path, check=False)
+            if oldest_commit.returncode != 0:
+                print(f'  > {LIGHT_RED}Skipping `{self.__folder_name}`\n\t{oldest_commit.stderr.strip()}. {WHITE}') # print error to end user
             else:
-                print(f'  > {LIGHT_RED}Skipping `{self.__folder_name}` because the hash is invalid (date is likely too far)\n\tOldest commit: {line.split("Date:   ")[1]}. {WHITE}') # print error to end user
+                print(f'  > {LIGHT_RED}Skipping `{self.__folder_name}` because the hash is invalid (date is likely too far)\n\tOldest commit: {oldest_commit.stdout.strip()}. {WHITE}') # print error to end user
             logging.exception('ERROR:') # log error to log file (logging automatically is passed exception)
 
 
     def get_commit_hash(self) -> str:
         '''
-        Get commit hash at timestamp and reset local repo to timestamp on the default branch
+        Get commit hash at timestamp on the default branch, chosen like cloneRepositories does (get_due_commit_args)
         '''
-        # git rev-parse --abbrev-ref origin/HEAD
-        get_default_branch = subprocess.Popen(['git', 'rev-parse', '--abbrev-ref', 'origin/HEAD'], cwd=self.__repo_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        with get_default_branch: # Read rev list output line by line to search for error or commit hash
-            for line in iter(get_default_branch.stdout.readline, b''): 
-                line = line.decode()
-                self.log_errors_given_line(line)
-                get_default_branch = line.strip() 
-
-        # run process on system that executes 'git rev-list' command. stdout is redirected so it doesn't output to end user
-        rev_list_process = subprocess.Popen(['git', 'rev-list', '-n', '1', f'--before="{self.__date_due} {self.__time_due}"', f'{get_default_branch}'], cwd=self.__repo_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        with rev_list_process: # Read rev list output line by line to search for error or commit hash
-            for line in iter(rev_list_process.stdout.readline, b''): # b'\n'-separated lines
-                line = line.decode()
-                self.log_errors_given_line(line) # if command returned error raise exception
-                return line.strip() # else returns commit hash of repo at timestamp
-        
+        # same as git rev-parse --abbrev-ref origin/HEAD, falls back to the checked out branch if the clone has no origin/HEAD
+        default_branch = read_origin_head(self.__repo_path) or 'HEAD'
+
+        # raises GitError if git fails (usually wrong branch name)
+        commit_hash = run_git(get_due_commit_args(default_branch, self.__date_due, self.__time_due), cwd=self.__repo_path).stdout.strip()
+        if not commit_hash:
+            raise ValueError(f'No commit before {self.__date_due} {self.__time_due}.')
+        return commit_hash
+
 
     def rollback_repo(self, commit_hash):
         '''
         Use commit hash and reset local repo to that commit (use git reset instead of git checkout to remove detached head warning)
         '''
-        # run process on system that executes 'git reset' command. stdout is redirected so it doesn't output to end user
         # git reset is similar to checkout but doesn't care about detached heads and is more forceful
-        checkout_process = subprocess.Popen(['git', 'reset', '--hard', commit_hash], cwd=self.__repo_path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         try:
             print(f'  > Rolling back {self.__folder_name}...') # tell end user what repo is being rolled back
-            self.log_errors_given_subprocess(checkout_process)
-            global ROLLBACK_COUNT
-            ROLLBACK_COUNT += 1
-        except Exception as e:
+            run_git(['reset', '--hard', '--quiet', commit_hash], cwd=self.__repo_path)
+            self.__result.add('rolled_back')
+        except GitError as e:
+            self.__result.add('failed')
             print(f'  > {LIGHT_RED}Rollback failed for `{self.__folder_name}` (likely due to invalid filename at specified commit).{WHITE}')
             logging.warning(f'Rollback failed for `{self.__folder_name}` (likely due to invalid filename at specified commit).')
-    
 
-    def log_errors_given_subprocess(self, subprocess: subprocess):
-        '''
-        Reads full git command output of a subprocess and raises exception & logs if error is found
-        '''
-        with subprocess:
-            for line in iter(subprocess.stdout.readline, b''): # b'\n'-separated lines
-                line = line.decode() # line is read in bytes. Decode to str
-                if re.match(r'^error:|^warning:|^fatal:', line): # if git command threw error (usually wrong branch name)
-                    logging.info('Subprocess: %r', line) # Log error
-                    raise Exception(f'An error has occured with git.') # Raise exception to the thread
-
-    
-    def log_errors_given_line(self, line: str):
-        '''
-        Given 1 line of git command output, check if error.
-        If so, log it and raise exception
-        '''
-        if re.match(r'^error:|^warning:|^fatal:', line): # if git command threw error (usually wrong branch name)
-            logging.info('Subprocess: %r', line) # Log error to log file
-            raise Exception(f'An error has occured with git.') # Raise exception to the thread
+
+def parse_args(args: list = None) -> argparse.Namespace:
+    '''
+    Parse command line options. Anything not given here is read from the config file or asked for
+    '''
+    parser = argparse.ArgumentParser(description='Roll back previously cloned repositories to a different date/time.')
+    parser.add_argument('-w', '--workers', type=int, default=MAX_WORKERS, help=f'number of repos rolled back at the same time (default: {MAX_WORKERS})')
+    parser.add_argument('-f', '--folder', metavar='NAME', help='assignment folder (in the config\'s output directory) to roll back instead of asking for it')
+    parser.add_argument('--due', type=parse_deadline, metavar='"DATE TIME"', help='due date to roll back to ("yyyy-mm-dd hh:mm") instead of asking for it. With --folder nothing is asked')
+    return parser.parse_args(args)
 
 
 def main():
+    args = parse_args()
     # Enable color in cmd
     if os.name == 'nt':
         os.system('color')
     # Create log file
     logging.basicConfig(level=logging.INFO, filename=LOG_FILE_PATH)
+    # Time every phase of every repo, written to tmp/metrics.jsonl
+    METRICS.start(command='changeCommit')
 
 # Try catch catches errors and sends them to the log file instead of outputting to console
     try:
         # Check local git version is compatible with script
         check_git_version()
-        # Check local PyGithub module version is compatible with script
-        check_pygithub_version()
-        # Read config file, if doesn't exist make one using user input.
-        token, organization, student_filename, output_dir, save_repo_stats, add_timestamp = read_config()
+        # Read config file, if doesn't exist make one using user input. Nothing is asked when the folder and due date are given
+        token, organization, student_filename, output_dir, save_repo_stats, add_timestamp = read_config(ask=not (args.folder and args.due))
 
         # makes the path of the directory that should exist
         initial_path = output_dir
@@ -131,63 +142,69 @@ def main():
         # we are now in the overarching folder for the assignment
         os.chdir(initial_path)
         
-        # Iterate over the directories in the folder
-        folders = dict()
-        i = 0
-
-        print(f"Scanned repos from '{initial_path}':")
-        for directory in os.listdir(initial_path):
-            i += 1
-            folders[i] = directory
-            print(f'  {i}: {directory}')
-        
-        print()
-
-        while True:
-            get_assignment = input("Which folder do you want to rollback? (enter number or press enter for recent): ")
-            if get_assignment:
-                try:
-                    assignment = folders.get(int(get_assignment))
-                    if assignment:
-                        break
-                except:
-                    pass
-            else :
-                assignment = folders.get(i)
-                print("assignment: " + assignment)
-                break
+        if args.folder: # given on the command line, nothing to pick
+            assignment = args.folder
+            if not os.path.isdir(assignment):
+                raise FileNotFoundError(f'{output_dir}/{assignment}')
+        else:
+            # Iterate over the directories in the folder
+            folders = dict()
+            i = 0
+
+            print(f"Scanned repos from '{initial_path}':")
+            for directory in os.listdir(initial_path):
+                i += 1
+                folders[i] = directory
+                print(f'  {i}: {directory}')
+            
+            print()
+
+            while True:
+                get_assignment = input("Which folder do you want to rollback? (enter number or press enter for recent): ")
+                if get_assignment:
+                    try:
+                        assignment = folders.get(int(get_assignment))
+                        if assignment:
+                            break
+                    except:
+                        pass
+                else :
+                    assignment = folders.get(i)
+                    print("assignment: " + assignment)
+                    break
         
         initial_path = f'{output_dir}/{assignment}'
 
-        date_due = get_date_due()
-        time_due = get_time_due()
+        if args.due:
+            date_due, time_due = args.due
+        else:
+            date_due = get_date_due()
+            time_due = get_time_due()
         
         print()
 
         print(f"Output directory: {initial_path}")
-        threads = []
+        result = RollbackResult()
+        pool = RepoWorkerPool(args.workers)
+        num_repos = 0
         for directory in os.listdir(initial_path):
-            if not re.findall("avgLinesInserted", directory):
-                path = f'{initial_path}/{directory}'
-                thread = RepoHandler(directory, path, date_due, time_due)
-                threads.append(thread)
-
-        # Run all clone threads
-        for thread in threads:
-            thread.start()
+            path = f'{initial_path}/{directory}'
+            if os.path.isdir(path): # skip avgLinesInserted.txt and the other stats files
+                pool.submit(RepoHandler(directory, path, date_due, time_due, result))
+                num_repos += 1
 
-        # Make main thread wait for all repos to be cloned, set back to due date/time, and avg lines per commit to be found
-        for thread in threads:
-            thread.join()
+        # Make main thread wait for all repos to be set back to due date/time
+        pool.shutdown()
 
         print()
         print(f'{LIGHT_GREEN}Done.{WHITE}')
-        print(f'{LIGHT_GREEN}{ROLLBACK_COUNT}/{len(threads)} repos have been rolled back to {date_due} {time_due}.{WHITE}')
+        print(f'{LIGHT_GREEN}{result.at_due_date()}/{num_repos} repos are at {date_due} {time_due} ({result.rolled_back} rolled back, {result.already_there} already there).{WHITE}')
+        METRICS.print_summary()
 
 
-    except FileNotFoundError as e: # If classroom roster file specified in config.txt isn't found.
+    except FileNotFoundError as e: # If classroom roster file specified in config.txt (or the --folder) isn't found.
         print()
-        print(f'Classroom roster `{student_filename}` not found.')
+        print(f'Folder `{e}` not found.' if args.folder else f'Classroom roster `{student_filename}` not found.')
         logging.error(e)
     except FileExistsError as e: # Error thrown if parent assignment file already exists
         print()
@@ -208,6 +225,7 @@ def main():
     except Exception as e: # If anything else happens
         print(f'ERROR: Something happened. Check {LOG_FILE_PATH}')
         logging.error(e)
+    METRICS.stop()
     exit()
 
 
@@ -1,71 +1,268 @@
+import argparse
+import asyncio
 import csv
+import json
 import logging
 import os
 import re
 import shutil
 import subprocess
-import _thread
-
-from datetime import date, datetime, timedelta
-from github import Github, GithubException
-from github.Organization import Organization
-from github.Repository import Repository
+import tarfile
+import time
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from commitStats import COMMIT_STATS_FILENAME, REPO_STATS_FILENAME, CommitStatsWriter, RepoStats, aiter_commit_stats, write_repo_stats_file
+from githubApi import CACHE_PATH, GithubApi, GithubApiError, RepoRecord, filter_repos_by_prefix
+from gitRunner import GitError, run_git, run_git_async
 from pathlib import Path
+from queue import Empty, Queue
+from repoJournal import FINISHED_STATES, JOURNAL_FILENAME, RepoJournal
+from runMetrics import METRICS
 from threading import Thread
 '''
 Script to clone all or some repositories in a Github Organization based on repo prefix and usernames
 @authors  Kamron Cole kjc8084@rit.edu, Trey Pachucki ttp2542@g.rit.edu, Jin Moon jym2584@rit.edu
 '''
 AVERAGE_LINES_FILENAME = 'avgLinesInserted.txt'
+RUN_REPORT_FILENAME = 'runReport.json' # What a run cloned and how long it took, mergeShards.py combines them
+GIT_VERSION_CACHE_FILENAME = 'gitVersion.json' # git binary -> version, saved in tmp/cache so `git --version` isn't run every time
 CONFIG_PATH = 'tmp/config.txt' # Stores token, org name, save class roster bool, class roster path, output dir
 BASE_GITHUB_LINK = 'https://github.com'
 MIN_GIT_VERSION = 2.30 # Required 2.30 minimum because of authentication changes
-MIN_PYGITHUB_VERSION = 1.55 # Requires 1.55 to allow threading
-MAX_THREADS = 200 # Max number of concurrent cloning processes
+MAX_WORKERS = 16 # Default number of repos processed at once (override with --workers)
 LOG_FILE_PATH = 'tmp/logs.log' # where the log file goes
+SHALLOW_WINDOW_DAYS = 14 # Default days of history before the due date fetched in shallow mode
+SHALLOW_DEEPEN_COMMITS = 8 # Commits fetched the first time a shallow clone doesn't reach the due date, doubles every retry
+GIT_RETRIES = 2 # Extra attempts for a clone/fetch that failed because of the network
+GIT_RETRY_DELAY = 2 # Seconds before the first retry, doubles every retry
+TRANSIENT_GIT_ERRORS = re.compile(r'Could not resolve host|Failed to connect|Couldn.t connect to server|Connection (timed out|reset|refused)|Operation timed out|early EOF|RPC failed|remote end hung up|returned error: (429|5\d\d)|TLS|SSL', re.IGNORECASE) # stderr of git failures worth retrying
+REFERENCE_REPOS_PATH = 'tmp/references' # Bare repos with each template's starter code, new clones borrow their objects through git alternates
 LIGHT_GREEN = '\033[1;32m' # Ansi code for light_green
 LIGHT_RED = '\033[1;31m' # Ansi code for light_red
 WHITE = '\033[0m' # Ansi code for white to reset back to normal text
-AVG_INSERTIONS_DICT = dict() # Global dict that threads map repos to average lines of code per commit
 
-class RepoHandler(Thread):
+class RepoWorkerPool:
+    '''
+    Fixed number of worker threads that pull repo jobs off a shared work queue.
+
+    A job is any object with a `run()` method (e.g. a RepoHandler) that does every step for one repo,
+    so no more than `num_workers` git processes ever run at the same time no matter how big the roster is.
+    If `run()` is a coroutine (RepoHandler) it runs on its own event loop in the worker. A job that raises only fails its own repo,
+    the other jobs keep going (RepoHandlers write the failure to the journal so `--resume` can redo it)
+    '''
+    __slots__ = ['__queue', '__workers']
+
+
+    def __init__(self, num_workers: int = MAX_WORKERS):
+        self.__queue = Queue() # jobs waiting for a free worker
+        self.__workers = [Thread(target=self.__work, daemon=True) for _ in range(max(1, num_workers))]
+        for worker in self.__workers:
+            worker.start()
+
+
+    def submit(self, job):
+        '''
+        Queue a job to be run by the next free worker
+        '''
+        self.__queue.put((job, time.perf_counter())) # queued time, how long jobs wait for a worker is recorded
+
+
+    def join(self):
+        '''
+        Block until every submitted job has finished. The pool can still be used afterwards
+        '''
+        self.__queue.join()
+
+
+    def shutdown(self):
+        '''
+        Wait for queued jobs to finish then stop the workers. Interrupting (ctrl+c) drops the jobs that haven't started
+        '''
+        for _ in self.__workers:
+            self.__queue.put((None, None)) # one stop signal per worker
+        try:
+            for worker in self.__workers:
+                worker.join()
+        except BaseException:
+            self.cancel()
+            raise
+
+
+    def cancel(self):
+        '''
+        Drops every job that hasn't started, the running ones finish. Workers stop once they're done (shutdown)
+        '''
+        num_stop_signals = 0
+        while True:
+            try:
+                job, _ = self.__queue.get_nowait()
+            except Empty:
+                break
+            self.__queue.task_done()
+            num_stop_signals += job is None
+        for _ in range(num_stop_signals): # only jobs are dropped, workers still get their stop signal
+            self.__queue.put((None, None))
+
+
+    def __work(self):
+        '''
+        Worker loop, runs jobs until it gets the stop signal
+        '''
+        while True:
+            job, queued_at = self.__queue.get()
+            try:
+                if job is None:
+                    return
+                METRICS.record_queue_wait(time.perf_counter() - queued_at)
+                result = job.run()
+                if asyncio.iscoroutine(result):
+                    asyncio.run(result)
+            except Exception: # already reported by the job, skip the repo
+                pass
+            finally:
+                self.__queue.task_done()
+
+
+class AsyncRepoPool:
     '''
-    A Thread that clones a repo, resets it to specific time, and gets average number of lines per commit
+    Runs repo jobs as asyncio tasks on one event loop thread instead of one thread per worker.
 
-    Each thread only clones one repo.
+    Same submit/join/shutdown as RepoWorkerPool, jobs must have an `async run()` (RepoHandler). Jobs start as soon as they're
+    submitted and at most `num_workers` run at the same time (a semaphore), so thousands of waiting repos only cost a coroutine each.
+    A job that raises only ends its own task, the other repos keep going. Cancelling the run (ctrl+c) kills every running git process
     '''
-    __slots___ = ['__repo', '__assignment_name', '__date_due', '__time_due', '__students', '__student_filename', '__initial_path', '__repo_path', '__stuident_name', '__repo_stats']
+    __slots__ = ['__loop', '__thread', '__semaphore', '__futures']
+
+
+    def __init__(self, num_workers: int = MAX_WORKERS):
+        self.__loop = asyncio.new_event_loop()
+        self.__loop.set_default_executor(ThreadPoolExecutor(max(1, num_workers))) # blocking steps (SnapshotHandler downloads) run here
+        self.__thread = Thread(target=self.__loop.run_forever, daemon=True)
+        self.__thread.start()
+        self.__semaphore = asyncio.run_coroutine_threadsafe(self.__make_semaphore(max(1, num_workers)), self.__loop).result()
+        self.__futures = [] # one per submitted job, done when the job is
+
 
+    def submit(self, job):
+        '''
+        Start a job on the event loop, it waits for the semaphore like a job waits for a free worker
+        '''
+        self.__futures.append(asyncio.run_coroutine_threadsafe(self.__run_job(job, time.perf_counter()), self.__loop))
 
-    def __init__(self, repo: Repository, assignment_name: str, date_due: str, time_due: str, students: dict, student_filename: str, initial_path: Path, repo_stats: bool = False):
-        self.__repo = repo # PyGithub repo object
+
+    def join(self):
+        '''
+        Block until every submitted job has finished. Interrupting (ctrl+c) cancels every job still running
+        '''
+        futures, self.__futures = self.__futures, []
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel() # cancels the task on the loop, its git process is killed
+            raise
+
+
+    def cancel(self):
+        '''
+        Cancels every submitted job that hasn't finished, running git processes are killed. shutdown still has to be called
+        '''
+        futures, self.__futures = self.__futures, [] # nothing left for join to wait on
+        for future in futures:
+            future.cancel()
+
+
+    def shutdown(self):
+        '''
+        Wait for submitted jobs to finish then stop the event loop
+        '''
+        try:
+            self.join()
+        finally:
+            # cancelled jobs still need the loop to kill their git process
+            asyncio.run_coroutine_threadsafe(self.__wait_for_tasks(), self.__loop).result()
+            self.__loop.call_soon_threadsafe(self.__loop.stop)
+            self.__thread.join()
+            self.__loop.close()
+
+
+    async def __wait_for_tasks(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+    async def __make_semaphore(self, num_workers: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(num_workers)
+
+
+    async def __run_job(self, job, queued_at: float):
+        async with self.__semaphore:
+            METRICS.record_queue_wait(time.perf_counter() - queued_at)
+            try:
+                await job.run()
+            except Exception: # already reported by the job, skip the repo
+                pass
+
+
+class RepoHandler:
+    '''
+    A job that clones a repo, resets it to specific time, and gets average number of lines per commit
+
+    Each job only clones one repo. `run` is a coroutine, jobs are run by a RepoWorkerPool or an AsyncRepoPool.
+    '''
+    __slots___ = ['__repo', '__assignment_name', '__date_due', '__time_due', '__students', '__student_filename', '__initial_path', '__repo_path', '__stuident_name', '__repo_stats', '__update', '__reference_path', '__shallow_days', '__stats_writer', '__deadlines', '__journal', '__sparse_paths', '__repo_stats_dict']
+
+
+    def __init__(self, repo: RepoRecord, assignment_name: str, date_due: str, time_due: str, students: 'RosterIndex', student_filename: str, initial_path: Path, repo_stats: bool = False, update: bool = False, reference_path: Path = None, shallow_days: int = None, stats_writer: CommitStatsWriter = None, deadlines: list = None, journal: RepoJournal = None, sparse_paths: list = None, repo_stats_dict: dict = None):
+        self.__repo = repo # repo metadata prefetched from the API
         self.__assignment_name = assignment_name # Repo name prefix
         self.__date_due = date_due 
         self.__time_due = time_due
-        self.__students = students #
+        self.__students = students # roster index mapping repo names to students
         self.__student_filename = student_filename
         self.__initial_path = initial_path
         self.__student_name = None # student's real name
         self.__repo_stats = repo_stats
+        self.__update = update # fetch into an existing clone instead of cloning again
+        self.__reference_path = reference_path # local repo with the starter code objects, None to clone everything
+        self.__shallow_days = shallow_days # days of history to fetch before the due date, None for full history
+        self.__stats_writer = stats_writer # csv every commit is written to when getting repo stats, None to skip
+        self.__deadlines = deadlines # (date due, time due, snapshot folder) oldest first to make worktrees for, None to reset the clone itself
+        self.__journal = journal # where the repo's progress is written, None to not keep one
+        self.__sparse_paths = sparse_paths # only these folders/patterns are checked out, None for every file
+        self.__repo_stats_dict = repo_stats_dict if repo_stats_dict is not None else dict() # the assignment's repo name -> RepoStats, filled by get_repo_stats
         if self.__student_filename: # If a classroom roster is used, replace github name with real name
-            self.__student_name = get_new_repo_name(self.__repo, self.__students, self.__assignment_name)
+            self.__student_name = get_new_repo_name(self.__repo, self.__students)
             self.__repo_path = self.__initial_path / self.__student_name # replace repo name when cloning to have student's real name
         else:
             self.__repo_path = self.__initial_path / self.__repo.name
-        super().__init__()
 
 
-    def run(self):
+    async def run(self):
         '''
         Clones given repo and renames destination to student real name if class roster is provided.
+        Every step is written to the journal, a resumed run skips repos an earlier run finished
         '''
         try:            
-
-            num_commits = self.__repo.get_commits().totalCount - 1 # commits always include the one created by github-classroom, want to avoid counting that
+            previous = self.__journal.get_previous(self.__repo.name) if self.__journal else None
+            if previous and previous['state'] in FINISHED_STATES and (previous['state'] == 'skipped' or self.is_cloned()):
+                if self.__repo_stats and previous.get('commit'): # stats files are rewritten every run, re-read them from the local repo
+                    with METRICS.phase('get_repo_stats', self.__repo.name):
+                        await self.get_repo_stats(previous['commit'])
+                self.__journal.record(self.__repo.name, previous['state'], **{key: previous[key] for key in ('commit', 'reason') if key in previous})
+                return
+            if previous and previous['state'] not in ('cloned', 'rolled_back') and Path.is_dir(self.__repo_path):
+                shutil.rmtree(self.__repo_path) # clone an earlier run didn't finish, start it over
+
+            num_commits = self.__repo.commit_count - 1 # commits always include the one created by github-classroom, want to avoid counting that
 
             if (num_commits <= 0): # skip repo if repo is created (with starter files), but no commits are made
                 print(f'  > {LIGHT_RED}Skipping `{self.__repo.name}` because it has 0 commits.{WHITE}')
                 logging.warning(f'Skipping repo `{self.__repo.name}` because it has 0 commits.')
+                self.record('skipped', reason='no commits')
                 return 
 
             date_due = datetime.strptime(f'{self.__date_due} {self.__time_due}:00', '%Y-%m-%d %H:%M:%S')
@@ -75,31 +272,62 @@ class RepoHandler(Thread):
             date_repo = self.__repo.created_at + timedelta(hours = offset) # convert github time to local
 
             if date_due > date_repo: # clone only if the repo was created before the due date
-                self.clone_repo() # clones repo
-                commit_hash = self.get_commit_hash() # get commit hash at due date
-                self.rollback_repo(commit_hash) # rollback repo to commit hash
+                # every phase is timed (and clone/fetch/checkout sizes measured) if metrics are recorded
+                if (self.__update or previous) and self.is_cloned():
+                    async with METRICS.aphase('fetch_repo', self.__repo.name, self.__repo_path):
+                        await self.fetch_repo() # only download what changed since the last pull
+                else:
+                    async with METRICS.aphase('clone_repo', self.__repo.name, self.__repo_path):
+                        await self.clone_repo() # clones repo
+                if not self.is_cloned():
+                    self.record('failed', reason='clone failed')
+                    return
+                self.record('cloned')
+                if self.__sparse_paths and not self.__deadlines: # worktrees get their own in make_snapshots
+                    with METRICS.phase('sparse_checkout', self.__repo.name):
+                        await self.set_sparse_checkout(self.__repo_path)
+                if self.__deadlines:
+                    with METRICS.phase('make_snapshots', self.__repo.name):
+                        commit_hash = await self.make_snapshots() # worktree at every deadline's commit, stats use the last one
+                else:
+                    with METRICS.phase('get_commit_hash', self.__repo.name):
+                        commit_hash = await self.get_commit_hash() # get commit hash at due date
+                    with METRICS.phase('rollback_repo', self.__repo.name):
+                        await self.rollback_repo(commit_hash) # rollback repo to commit hash
+                self.record('rolled_back')
                 
-                if self.__repo_stats:
-                    self.get_repo_stats() # get average lines per commit
+                if self.__repo_stats and commit_hash:
+                    with METRICS.phase('get_repo_stats', self.__repo.name):
+                        await self.get_repo_stats(commit_hash) # get average lines per commit
+                self.record('done', commit=commit_hash)
 
             else:
                 print(f'  > {LIGHT_RED}Skipping `{self.get_name()}` because it was created past the due date (created: {date_repo}).{WHITE}')
                 #print(f"""{LIGHT_RED}Skipping `{self.__repo.name}` because it was created past the due date (created: {date_repo}).{WHITE}\n\tOLDEST COMMIT:\n\t\tauthor={self.__repo.get_commits().reversed[0].commit.author.name},\n\t\tcreated={self.__repo.get_commits().reversed[0].commit.author.date + timedelta(hours = UTC_OFFSET)},\n\t\tmessage={self.__repo.get_commits().reversed[0].commit.message}\n\tNEWEST COMMIT:\n\t\tauthor={self.__repo.get_commits()[0].commit.author.name},\n\t\tcreated={self.__repo.get_commits()[0].commit.author.date + timedelta(hours = UTC_OFFSET)},\n\t\tmessage={self.__repo.get_commits()[0].commit.message}""")
                 logging.warning(f'Skipping `{self.get_name()}`  because it was created past the due date (created: {date_repo}).')
+                self.record('skipped', reason='created after the due date')
                 return 
 
-        except IndexError as e: # Catch exception raised by get_repo_stats
-            print(f'  > {LIGHT_RED}IndexError while finding average lines per commit for `{self.get_name()}`.{WHITE}') # Print error to end user
-            logging.warning(f'IndexError while finding average lines per commit for `{self.get_name()}`.') # log warning to log file
-        except GithubException as e: # likely because github repo is made (without starter files) but no commits
-            print(f'  > {LIGHT_RED}Skipping `{self.get_name()}` because {e.data["message"]} (pygithub exception){WHITE}')
-        except: # Catch exception raised and interrupt main thread
+        except (ValueError, IndexError) as e: # Catch exception raised by get_repo_stats when git log output can't be parsed
+            print(f'  > {LIGHT_RED}Could not parse commit stats for `{self.get_name()}`.{WHITE}') # Print error to end user
+            logging.warning(f'Could not parse commit stats for `{self.get_name()}`: {e}') # log warning to log file
+            self.record('done', commit=None, reason='commit stats could not be parsed')
+        except Exception as e: # Catch exception raised, report it and pass it to the engine
             print(f'  > {LIGHT_RED}ERROR: Sorry, ran into a problem while cloning `{self.get_name()}`. Check {LOG_FILE_PATH}.{WHITE}') # print error to end user
             logging.exception('ERROR:') # log error to log file (logging automatically is passed exception)
-            _thread.interrupt_main() # Interrupt main thread. 
+            self.record('failed', reason=str(e) or type(e).__name__)
+            raise # the engine running the job logs it, the rest of the run goes on
 
 
-    def clone_repo(self):
+    def record(self, state: str, **fields):
+        '''
+        Writes the repo's new state to the journal if there is one
+        '''
+        if self.__journal:
+            self.__journal.record(self.__repo.name, state, **fields)
+
+
+    async def clone_repo(self):
         '''
         Clones a repo into the assignment folder.
 
@@ -108,38 +336,167 @@ class RepoHandler(Thread):
         '''
 
         print(f'  > Cloning {self.get_name()}...') # tell end user what repo is being cloned and where it is going to
-        # run process on system that executes 'git clone' command. stdout is redirected so it doesn't output to end user
-        clone_process = subprocess.Popen(['git', 'clone', self.__repo.clone_url, f'{str(self.__repo_path)}'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT) # git clone to output file, Hides output from console
+        clone_command = ['clone', '--quiet']
+        if self.__reference_path: # borrow starter code objects from the reference repo instead of downloading them again
+            clone_command += ['--reference-if-able', str(self.__reference_path)]
+        if self.__shallow_days is not None or self.__deadlines or self.__sparse_paths:
+            # Only fetch the history window before the due date (or only check out the graded paths). rollback_repo or the worktrees do the checkout at the due date commit
+            clone_command += ['--no-checkout']
+            if not self.__repo_stats: # file contents are only needed for the due date tree, git fetches them on checkout
+                clone_command += ['--filter=blob:none']
         try:
-            self.log_errors_given_subprocess(clone_process) # reads output line by line and checks for errors that occured during cloning
-        except Exception as e:
+            if self.__shallow_days is not None:
+                try:
+                    await self.run_clone(clone_command + [f'--shallow-since={self.get_shallow_since()}'])
+                except GitError as e:
+                    # Fails when no commits were made inside the window, the latest commit is then the one at the due date
+                    await self.run_clone(clone_command + ['--depth', '1'])
+            else:
+                await self.run_clone(clone_command)
+        except GitError as e:
             print(f'  > {LIGHT_RED}Skipping `{self.get_name()}` because clone failed (likely due to invalid filename).{WHITE}') # print error to end user
             logging.warning(f'Skipping repo `{self.get_name()}` because clone failed (likely due to invalid filename).') # log error to log file
+            return
+
+        if self.__reference_path:
+            # Repos made from a template get a new first commit, so the server still sends the starter files.
+            # Repacking with --local drops every object the reference repo already has so it is only stored once.
+            try:
+                await run_git_async(['repack', '-a', '-d', '-l', '-q'], cwd=self.__repo_path)
+            except GitError as e:
+                logging.warning(f'Repack against reference repo failed for `{self.get_name()}`.')
     
 
-    def get_commit_hash(self) -> str:
+    async def run_clone(self, clone_command: list):
         '''
-        Get commit hash at timestamp and reset local repo to timestamp on the default branch
+        Runs the given git clone command into the repo's folder, network errors are retried. Raises GitError if the clone failed
         '''
-        # run process on system that executes 'git rev-list' command. stdout is redirected so it doesn't output to end user
-        rev_list_process = subprocess.Popen(['git', 'rev-list', '-n', '1', f'--before="{self.__date_due} {self.__time_due}"', f'origin/{self.__repo.default_branch}'], cwd=self.__repo_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        with rev_list_process: # Read rev list output line by line to search for error or commit hash
-            for line in iter(rev_list_process.stdout.readline, b''): # b'\n'-separated lines
-                line = line.decode()
-                self.log_errors_given_line(line) # if command returned error raise exception
-                return line.strip() # else returns commit hash of repo at timestamp
-        
+        await run_git_with_retries(clone_command + [self.__repo.clone_url, str(self.__repo_path)], self.get_name(), cleanup_path=self.__repo_path)
+
 
-    def rollback_repo(self, commit_hash):
+    def get_shallow_since(self) -> str:
+        '''
+        Returns the start of the history window fetched in shallow mode, counted from the earliest deadline
+        '''
+        date_due, time_due = (self.__deadlines[0][0], self.__deadlines[0][1]) if self.__deadlines else (self.__date_due, self.__time_due)
+        date_due = datetime.strptime(f'{date_due} {time_due}', '%Y-%m-%d %H:%M')
+        return (date_due - timedelta(days = self.__shallow_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+    def is_shallow(self) -> bool:
+        '''
+        Returns whether the local repo is missing older history (git keeps the cut off commits in .git/shallow)
+        '''
+        return Path.is_file(self.__repo_path / '.git' / 'shallow')
+
+
+    async def deepen_repo(self, num_commits: int):
+        '''
+        Fetches num_commits more commits of history into a shallow repo
+        '''
+        logging.info(f'Deepening `{self.get_name()}` by {num_commits} commits.')
+        await run_git_async(['fetch', '--quiet', f'--deepen={num_commits}', 'origin'], cwd=self.__repo_path)
+
+
+    def is_cloned(self) -> bool:
+        '''
+        Returns whether the repo was already cloned into the assignment folder by a previous run
+        '''
+        return Path.is_dir(self.__repo_path / '.git')
+
+
+    async def fetch_repo(self):
+        '''
+        Fetches new commits into a repo cloned by a previous run. The reset done afterwards puts it at the new due date
+        '''
+        print(f'  > Updating {self.get_name()}...') # tell end user what repo is being updated
+        try:
+            await run_git_with_retries(['fetch', '--quiet', '--prune', 'origin'], self.get_name(), cwd=self.__repo_path)
+        except GitError as e:
+            print(f'  > {LIGHT_RED}Fetch failed for `{self.get_name()}`, using the commits from the last pull.{WHITE}') # print error to end user
+            logging.warning(f'Fetch failed for `{self.get_name()}`, using the commits from the last pull.') # log error to log file
+
+
+    async def get_commit_hash(self, date_due: str = None, time_due: str = None) -> str:
+        '''
+        Get commit hash at timestamp (the due date if not given) on the default branch.
+        Shallow repos are deepened until the commit is in the local history
+        '''
+        date_due = date_due or self.__date_due
+        time_due = time_due or self.__time_due
+        commit_hash = await self.rev_list_due(date_due, time_due)
+        num_commits = SHALLOW_DEEPEN_COMMITS
+        while not commit_hash and self.__shallow_days is not None and self.is_shallow():
+            await self.deepen_repo(num_commits)
+            num_commits *= 2
+            commit_hash = await self.rev_list_due(date_due, time_due)
+        return commit_hash
+
+
+    async def rev_list_due(self, date_due: str, time_due: str) -> str:
+        '''
+        Returns the newest local commit on the default branch made before the due date, None if there isn't one
+        '''
+        # raises GitError if git fails (usually wrong branch name)
+        rev_list = await run_git_async(get_due_commit_args(f'origin/{self.__repo.default_branch}', date_due, time_due), cwd=self.__repo_path)
+        return rev_list.stdout.strip() or None
+
+
+    async def make_snapshots(self) -> str:
+        '''
+        Adds a worktree of the clone in every deadline's folder, checked out at the commit at that deadline.
+        Worktrees share the clone's objects so each extra deadline only costs a checkout. Returns the last deadline's commit hash
+        '''
+        commit_hash = None
+        for date_due, time_due, snapshot_path in self.__deadlines:
+            commit_hash = await self.get_commit_hash(date_due, time_due)
+            if not commit_hash:
+                print(f'  > {LIGHT_RED}No snapshot of `{self.get_name()}` for {date_due} {time_due} because it has no commits before then.{WHITE}')
+                logging.warning(f'No snapshot of `{self.get_name()}` for {date_due} {time_due} because it has no commits before then.')
+                continue
+            worktree_path = snapshot_path / self.__repo_path.name
+            if Path.is_dir(worktree_path): # left by an earlier run that didn't finish the repo (--resume)
+                shutil.rmtree(worktree_path)
+            try:
+                # --force reuses the worktree name if an earlier run's snapshot folder was deleted
+                if self.__sparse_paths: # make the worktree empty, limit it to the graded paths then check them out
+                    await run_git_async(['worktree', 'add', '--force', '--detach', '--no-checkout', '--quiet', str(worktree_path), commit_hash], cwd=self.__repo_path)
+                    await self.set_sparse_checkout(worktree_path)
+                    await run_git_async(['reset', '--hard', '--quiet', commit_hash], cwd=worktree_path)
+                else:
+                    await run_git_async(['worktree', 'add', '--force', '--detach', '--quiet', str(worktree_path), commit_hash], cwd=self.__repo_path)
+            except GitError as e:
+                print(f'  > {LIGHT_RED}Snapshot failed for `{self.get_name()}` at {date_due} {time_due} (likely due to invalid filename at specified commit).{WHITE}')
+                logging.warning(f'Snapshot failed for `{self.get_name()}` at {date_due} {time_due}: {e}')
+        return commit_hash
+
+
+    async def set_sparse_checkout(self, path: Path):
+        '''
+        Limits the files checked out in path (the clone or a deadline's worktree) to the graded paths. Takes effect at the next checkout/reset.
+        Folders (`src/`) use cone mode (git matches whole folders plus the top level files), anything else is a .gitignore style pattern
+        '''
+        if is_cone_paths(self.__sparse_paths):
+            await run_git_async(['sparse-checkout', 'init', '--cone'], cwd=path)
+            patterns = [sparse_path.strip('/') for sparse_path in self.__sparse_paths]
+        else:
+            await run_git_async(['sparse-checkout', 'init', '--no-cone'], cwd=path)
+            patterns = self.__sparse_paths
+        await run_git_async(['sparse-checkout', 'set', '--stdin'], cwd=path, input='\n'.join(patterns).encode())
+
+
+    async def rollback_repo(self, commit_hash):
         '''
         Use commit hash and reset local repo to that commit (use git reset instead of git checkout to remove detached head warning)
         '''
-        # run process on system that executes 'git reset' command. stdout is redirected so it doesn't output to end user
+        if not commit_hash:
+            print(f'  > {LIGHT_RED}Rollback failed for `{self.get_name()}` because it has no commits before the due date.{WHITE}')
+            logging.warning(f'Rollback failed for `{self.get_name()}` because it has no commits before the due date.')
+            return
         # git reset is similar to checkout but doesn't care about detached heads and is more forceful
-        checkout_process = subprocess.Popen(['git', 'reset', '--hard', commit_hash], cwd=self.__repo_path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
         try:
-            self.log_errors_given_subprocess(checkout_process)
-        except Exception as e:
+            await run_git_async(['reset', '--hard', '--quiet', commit_hash], cwd=self.__repo_path)
+        except GitError as e:
             print(f'  > {LIGHT_RED}Rollback failed for `{self.get_name()}` (likely due to invalid filename at specified commit).{WHITE}')
             logging.warning(f'Rollback failed for `{self.get_name()}` (likely due to invalid filename at specified commit).')
     
@@ -153,80 +510,413 @@ class RepoHandler(Thread):
         else:
             return f'{self.__repo.name}'
 
-    def get_repo_stats(self):
-        '''
-        Get commit history stats and find average number of insertions per commit
-        '''
-        # run process on system that executes 'git log' command. stdout is redirected so it doesn't output to end user
-        # output is something like this format:
-        # <short commit hash> <commit message>
-        #  <x> file(s) changed, <x> insertions(+)
-        log_process = subprocess.Popen(['git', 'log', '--oneline', '--shortstat'], cwd=self.__repo_path, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        # Loop through response line by line
-        repo_stats = [] # list to store each commits insertion number
-        with log_process:
-            for line in iter(log_process.stdout.readline, b''): # b'\n'-separated lines
-                line = line.decode()
-                self.log_errors_given_line(line)
-                if (re.match(r"\s\d+\sfile.*changed,\s\d+\sinsertion.*[(+)].*", line)): # if line has insertion number in it
-                    # Replaces all non digits in a string with nothing and appends the commit's stats to repo_stats list
-                    # [0] = files changed
-                    # [1] = insertions
-                    # [2] = deletions (if any, might not be an index)
-                    repo_stats.append([re.sub(r'\D', '', value) for value in line.strip().split(', ')])
-
-        try:
-            total_commits = len(repo_stats) # each index in repo_stats should be a commit
-            total_insertions = 0
-            # Loop through repos stats and find total number of insertions
-            for i in range(total_commits):
-                insertions = int(repo_stats[i][1])
-                total_insertions += insertions
-        except IndexError as e: # If an index error occurs for some reason, raise error
-            raise e
-
-        # Calc avg and place in global dictionary using maped repo name if student roster is provided or normal repo name
-        average_insertions = round(total_insertions / total_commits, 2)
+    async def get_repo_stats(self, revision: str = 'HEAD'):
+        '''
+        Get commit history stats up to revision in one streaming pass over git log and find average number of insertions per commit.
+        Every commit is also written to the commit stats csv if one is open
+        '''
         if self.__student_filename: # If using a classroom roster, replace repo name in avgLinesInserted.txt w/ student name
-            AVG_INSERTIONS_DICT[get_new_repo_name(self.__repo, self.__students, self.__assignment_name)] = average_insertions
+            repo_name = get_new_repo_name(self.__repo, self.__students)
         else: # else use default repo name
-            AVG_INSERTIONS_DICT[self.__repo.name] = average_insertions
+            repo_name = self.__repo.name
+
+        repo_stats = RepoStats() # running totals, commits aren't kept after they're counted
+        async for commit in aiter_commit_stats(self.__repo_path, revision):
+            repo_stats.add(commit)
+            if self.__stats_writer:
+                self.__stats_writer.write_commit(repo_name, commit)
+
+        # Place in the assignment's dictionary using maped repo name if student roster is provided or normal repo name
+        self.__repo_stats_dict[repo_name] = repo_stats
+
+
+async def run_git_with_retries(args: list, name: str, cwd: Path = None, cleanup_path: Path = None):
+    '''
+    Runs a git command that talks to Github. Failures that look like network trouble are retried up to GIT_RETRIES times,
+    waiting GIT_RETRY_DELAY seconds then twice as long every time. cleanup_path (a half made clone) is removed before a retry.
+    Raises the GitError of the last attempt
+    '''
+    for attempt in range(GIT_RETRIES + 1):
+        try:
+            return await run_git_async(args, cwd=cwd)
+        except GitError as e:
+            if attempt == GIT_RETRIES or not TRANSIENT_GIT_ERRORS.search(e.result.stderr):
+                raise
+            delay = GIT_RETRY_DELAY * 2 ** attempt
+            logging.warning(f'`{name}`: {e}. Retrying in {delay}s.')
+            if cleanup_path:
+                shutil.rmtree(cleanup_path, ignore_errors=True)
+            await asyncio.sleep(delay)
+
+
+def is_cone_paths(sparse_paths: list) -> bool:
+    '''
+    Returns whether sparse checkout paths are all folders written with a trailing `/` (`src/`), which git matches in cone mode.
+    Anything else (`*.py`, `src/main.py`) is used as a .gitignore style pattern
+    '''
+    return all(sparse_path.endswith('/') and not re.search(r'[*?\[\]!]', sparse_path) for sparse_path in sparse_paths)
+
+
+def get_due_commit_args(branch: str, date_due: str, time_due: str) -> list:
+    '''
+    Returns the git arguments that print the newest commit on branch made before the due date (every parent, not only the first).
+    cloneRepositories and changeCommit both pick the due date commit with it, so they agree on which commit that is
+    '''
+    return ['rev-list', '-n', '1', f'--before={date_due} {time_due}', branch]
+
+
+def get_due_datetime(date_due: str, time_due: str) -> datetime:
+    '''
+    Returns the due date (local time, like every due date the scripts are given) as an aware datetime
+    '''
+    return datetime.strptime(f'{date_due} {time_due}', '%Y-%m-%d %H:%M').astimezone()
+
+
+def extract_tarball(stream, destination: Path) -> int:
+    '''
+    Extracts a Github tarball read from stream (one pass, never saved) into destination, without the `<owner>-<repo>-<sha>/`
+    folder every path in it starts with. Files, folders and symlinks are made like a clone checks them out (on Windows links are
+    files holding the target and names git can't check out there are skipped, like git does), paths leaving destination are skipped.
+    Returns the number of files written
+    '''
+    num_files = 0
+    destination.mkdir(parents=True, exist_ok=True)
+    root = destination.resolve()
+    with tarfile.open(fileobj=stream, mode='r|gz') as tarball:
+        for member in tarball:
+            parts = member.name.split('/')[1:] # drop the top folder
+            if not parts or any(part in ('', '.', '..') for part in parts) or (os.name == 'nt' and (':' in member.name or '\\' in member.name)):
+                continue
+            path = destination.joinpath(*parts)
+            if not path.parent.resolve().is_relative_to(root): # under a link pointing out of the folder
+                continue
+            if member.isdir():
+                path.mkdir(parents=True, exist_ok=True)
+            elif member.isfile() or (member.issym() and os.name == 'nt'):
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if member.issym(): # git's core.symlinks=false checkout
+                    path.write_bytes(member.linkname.encode())
+                else:
+                    with tarball.extractfile(member) as source, open(path, 'wb') as target:
+                        shutil.copyfileobj(source, target)
+                    if member.mode & 0o100: # keep scripts executable
+                        os.chmod(path, 0o755)
+                num_files += 1
+            elif member.issym():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                os.symlink(member.linkname, path) # target kept as is, like a clone
+                num_files += 1
+    return num_files
+
+
+def update_reference_repo(assignment_name: str, repos: list) -> Path:
+    '''
+    Creates or updates the local bare repo holding the starter code of the assignment's template.
+    Uses the template repository if Github knows it, otherwise the first student repo (its first commit is the starter code).
+    Returns the absolute path of the reference repo or None if it could not be made (repos are then cloned normally)
+    '''
+    if not repos:
+        return None
+
+    if repos[0].template_full_name: # only set if the repos were generated from a template
+        reference_path = Path(REFERENCE_REPOS_PATH, f'{repos[0].template_full_name.replace("/", "-")}.git').resolve()
+        source_url = repos[0].template_clone_url
+    else:
+        reference_path = Path(REFERENCE_REPOS_PATH, f'{assignment_name}.git').resolve()
+        source_url = repos[0].clone_url
+        if Path.is_dir(reference_path): # student repo was already used as reference, objects never change so don't refetch
+            return reference_path
+
+    print(f'Updating reference repo for `{assignment_name}`...')
+    if not Path.is_dir(reference_path):
+        reference_path.parent.mkdir(parents=True, exist_ok=True)
+        run_git(['init', '--bare', '-q', str(reference_path)])
+
+    # Fetch every branch of the source. Objects are never pruned from the reference, clones that borrow them depend on them
+    try:
+        run_git(['fetch', '-q', source_url, '+refs/heads/*:refs/heads/*'], cwd=reference_path)
+    except GitError as e:
+        print(f'{LIGHT_RED}Could not update reference repo from `{source_url}`, cloning without it.{WHITE}')
+        logging.warning(f'Reference repo fetch failed: {e}')
+        return None
+    return reference_path
+
+
+def get_repo_records(repos: list, organization: str, github_api: GithubApi) -> list:
+    '''
+    Prefetch commit count, creation time, default branch, etc. for all repos in a few batched GraphQL requests.
+    Returns list of RepoRecords in the same order as repos
+    '''
+    records = github_api.get_repo_records(organization, [repo.name for repo in repos])
+    for repo in repos:
+        if repo.name not in records:
+            print(f'  > {LIGHT_RED}Skipping `{repo.name}` because its metadata could not be found.{WHITE}')
+            logging.warning(f'Skipping repo `{repo.name}` because its metadata could not be found.')
+    return [records[repo.name] for repo in repos if repo.name in records]
+
+
+class SnapshotHandler:
+    '''
+    A job that downloads a repo's files at the due date (every deadline's with --deadlines) instead of cloning it.
+
+    The due date commit (found through the API when the repo was queued) has its tarball streamed straight into the student's folder,
+    so no git repo or temp file is made. Like RepoHandler, `run` is a coroutine run by a RepoWorkerPool or an AsyncRepoPool, the blocking
+    downloads run on threads so the async engine keeps many going at once
+    '''
+    __slots__ = ['__repo', '__organization', '__github_api', '__snapshots', '__folder_name', '__journal']
+
+
+    def __init__(self, repo: RepoRecord, organization: str, github_api: GithubApi, snapshots: list, folder_name: str, journal: RepoJournal = None):
+        self.__repo = repo # repo metadata prefetched from the API
+        self.__organization = organization
+        self.__github_api = github_api
+        self.__snapshots = snapshots # (date due, time due, folder, commit sha or None) oldest first, the repo's files go in folder/folder_name
+        self.__folder_name = folder_name # repo name, or the student's name with a class roster
+        self.__journal = journal # where the repo's progress is written, None to not keep one
+
+
+    async def run(self):
+        '''
+        Downloads the repo's files at every due date, skipping repos an earlier run finished (--resume)
+        '''
+        try:
+            previous = self.__journal.get_previous(self.__repo.name) if self.__journal else None
+            if previous and previous['state'] in FINISHED_STATES and (previous['state'] == 'skipped' or Path.is_dir(self.__snapshots[-1][2] / self.__folder_name)):
+                self.record(previous['state'], **{key: previous[key] for key in ('commit', 'reason') if key in previous})
+                return
+
+            if self.__repo.commit_count - 1 <= 0: # commits always include the one created by github-classroom
+                print(f'  > {LIGHT_RED}Skipping `{self.__repo.name}` because it has 0 commits.{WHITE}')
+                logging.warning(f'Skipping repo `{self.__repo.name}` because it has 0 commits.')
+                self.record('skipped', reason='no commits')
+                return
+
+            commit_hash = None
+            for date_due, time_due, folder, snapshot_hash in self.__snapshots:
+                if self.__repo.created_at.replace(tzinfo=timezone.utc) >= get_due_datetime(date_due, time_due): # created_at is UTC
+                    print(f'  > {LIGHT_RED}Skipping `{self.get_name()}` at {date_due} {time_due} because it was created past the due date.{WHITE}')
+                    logging.warning(f'Skipping `{self.get_name()}` at {date_due} {time_due} because it was created past the due date.')
+                    continue
+                if not snapshot_hash:
+                    print(f'  > {LIGHT_RED}No snapshot of `{self.get_name()}` for {date_due} {time_due} because it has no commits before then.{WHITE}')
+                    logging.warning(f'No snapshot of `{self.get_name()}` for {date_due} {time_due} because it has no commits before then.')
+                    continue
+
+                commit_hash = snapshot_hash
+                path = folder / self.__folder_name
+                if Path.is_dir(path): # left by an earlier run (--update/--resume), replaced by a fresh download
+                    shutil.rmtree(path)
+                print(f'  > Downloading {self.get_name()}...')
+                with METRICS.phase('download_tarball', self.__repo.name):
+                    await asyncio.to_thread(self.__github_api.download_tarball, self.__organization, self.__repo.name, commit_hash, lambda stream: extract_tarball(stream, path))
+            if commit_hash:
+                self.record('done', commit=commit_hash)
+            else:
+                self.record('skipped', reason='nothing before the due date')
+
+        except Exception as e: # Catch exception raised, report it and pass it to the engine
+            print(f'  > {LIGHT_RED}ERROR: Sorry, ran into a problem while downloading `{self.get_name()}`. Check {LOG_FILE_PATH}.{WHITE}') # print error to end user
+            logging.exception('ERROR:') # log error to log file (logging automatically is passed exception)
+            self.record('failed', reason=str(e) or type(e).__name__)
+            raise # the engine running the job logs it, the rest of the run goes on
 
 
-    def log_errors_given_subprocess(self, subprocess: subprocess):
+    def get_name(self) -> str:
         '''
-        Reads full git command output of a subprocess and raises exception & logs if error is found
+        Returns what name should be printed when downloading repos
         '''
-        with subprocess:
-            for line in iter(subprocess.stdout.readline, b''): # b'\n'-separated lines
-                line = line.decode() # line is read in bytes. Decode to str
-                if re.match(r'^error:|^warning:|^fatal:', line): # if git command threw error (usually wrong branch name)
-                    logging.info('Subprocess: %r', line) # Log error
-                    raise Exception(f'An error has occured with git.') # Raise exception to the thread
+        if self.__folder_name != self.__repo.name:
+            return f'{self.__repo.name} ({self.__folder_name})'
+        return self.__repo.name
 
-    
-    def log_errors_given_line(self, line: str):
+
+    def record(self, state: str, **fields):
         '''
-        Given 1 line of git command output, check if error.
-        If so, log it and raise exception
+        Writes the repo's new state to the journal if there is one
         '''
-        if re.match(r'^error:|^warning:|^fatal:', line): # if git command threw error (usually wrong branch name)
-            logging.info('Subprocess: %r', line) # Log error to log file
-            raise Exception(f'An error has occured with git.') # Raise exception to the thread
+        if self.__journal:
+            self.__journal.record(self.__repo.name, state, **fields)
 
 
-def get_repos(assignment_name: str, github_org_client: Organization) -> list:
+class AssignmentPull:
     '''
-    return list of all repos in an organization matching assignment name prefix
+    One assignment of a run: its due date(s), output folder, roster and the repos queued for it.
+
+    A run pulls one assignment, or every assignment of a manifest (--manifest) with the same Github client, org listing and worker pool.
+    The output folder, journal, reference repo and stats csv are set up when the assignment's first repos are found
     '''
-    return [repo for repo in github_org_client.get_repos() if assignment_name in repo.name]
+    __slots__ = ['__assignment_name', '__date_due', '__time_due', '__deadlines', '__initial_path', '__students', '__use_roster', '__save_repo_stats', '__args', '__repos', '__reference_path', '__stats_writer', '__journal', '__sparse_paths', '__repo_stats_dict']
 
 
-def get_repos_specified_students(assignment_name: str, github_org_client: Organization, students: list) -> list:
+    def __init__(self, assignment_name: str, deadline_list: list, output_dir: Path, add_timestamp: bool, students: dict, use_roster: bool, save_repo_stats: bool, args: argparse.Namespace, sparse_paths: list = None):
+        self.__assignment_name = assignment_name # Repo name prefix
+        shard_suffix = f'-shard-{args.shard[0]}-of-{args.shard[1]}' if args.shard else '' # shards get their own folders so they can share a drive
+        self.__deadlines = None
+        if len(deadline_list) > 1: # several deadlines: one clone per repo, one worktree per deadline
+            self.__deadlines = [(date_due, time_due, output_dir / f'{assignment_name}-{get_time_folder(date_due, time_due)}{shard_suffix}') for date_due, time_due in sorted(set(deadline_list))]
+            self.__date_due, self.__time_due, _ = self.__deadlines[-1] # repos created before the last deadline are cloned
+            self.__initial_path = output_dir / f'{assignment_name}-repos{shard_suffix}' # the clones, kept between runs so deadlines can be added later
+        else:
+            self.__date_due, self.__time_due = deadline_list[0]
+            if add_timestamp:
+                self.__initial_path = output_dir / f'{assignment_name}-{get_time_folder(self.__date_due, self.__time_due)}{shard_suffix}'
+            else:
+                self.__initial_path = output_dir / f'{assignment_name}{shard_suffix}'
+        self.__students = RosterIndex(students, assignment_name) # index github usernames to student names
+        self.__use_roster = use_roster # only the roster's repos are cloned and they're renamed to the student's name
+        self.__save_repo_stats = save_repo_stats and not args.snapshot # snapshots have no history to count
+        self.__args = args # command line options shared by every assignment of the run
+        self.__sparse_paths = sparse_paths or args.sparse # graded paths to check out (manifest, else --sparse), None for every file
+        self.__repos = [] # every repo queued so far
+        self.__reference_path = None
+        self.__stats_writer = None
+        self.__journal = None
+        self.__repo_stats_dict = dict() # repo (or student) name -> RepoStats of this assignment only, threads write to it
+
+
+    def matches(self, repo: RepoRecord) -> bool:
+        '''
+        Returns whether a listed repo belongs to the assignment (prefix, roster and shard)
+        '''
+        return repo.name.startswith(f'{self.__assignment_name}-') and (not self.__use_roster or is_student(repo, self.__students)) and in_shard(repo.name, self.__args.shard)
+
+
+    def queue(self, records: list, pool, github_api: GithubApi, organization: str):
+        '''
+        Submits a RepoHandler (SnapshotHandler with --snapshot) for every record to pool.
+        The first time, sets up the output folders (and reference repo and stats csv) first
+        '''
+        if not self.__repos:
+            self.setup()
+            if self.__args.reference and not self.__args.snapshot:
+                with METRICS.phase('update_reference_repo'):
+                    self.__reference_path = update_reference_repo(self.__assignment_name, records)
+
+        if self.__args.snapshot: # due date commits of the whole page in a few batched requests
+            snapshot_folders = self.__deadlines or [(self.__date_due, self.__time_due, self.__initial_path)]
+            with METRICS.phase('get_commit_hash'):
+                snapshot_commits = [github_api.get_commits_at(organization, [repo.name for repo in records], get_due_datetime(date_due, time_due)) for date_due, time_due, _ in snapshot_folders]
+
+        for repo in records:
+            self.__journal.record(repo.name, 'listed') # before the job can write its own states
+            if self.__args.snapshot: # only the files at the due date(s), straight from Github's tarballs
+                folder_name = get_new_repo_name(repo, self.__students) if self.__use_roster else repo.name
+                snapshots = [(date_due, time_due, folder, commits.get(repo.name)) for (date_due, time_due, folder), commits in zip(snapshot_folders, snapshot_commits)]
+                pool.submit(SnapshotHandler(repo, organization, github_api, snapshots, folder_name, self.__journal))
+                continue
+            # Each job clones a repo, sets it back to due date/time, and gets avg lines per commit
+            pool.submit(RepoHandler(repo, self.__assignment_name, self.__date_due, self.__time_due, self.__students, self.__use_roster, self.__initial_path, self.__save_repo_stats,
+                                    self.__args.update or bool(self.__deadlines), self.__reference_path, self.__args.shallow, self.__stats_writer, self.__deadlines, self.__journal, self.__sparse_paths, self.__repo_stats_dict))
+        self.__repos += records
+
+
+    def setup(self):
+        '''
+        Makes the output folders and opens the journal and commit stats csv. A resumed run keeps the folders and journal of the earlier run
+        '''
+        print()
+        print(f'Output directory: {self.__initial_path}')
+        setup_output_folders(self.__initial_path, self.__deadlines, self.__args.update, self.__args.resume)
+        deadlines = [(date_due, time_due) for date_due, time_due, _ in self.__deadlines] if self.__deadlines else [(self.__date_due, self.__time_due)]
+        self.__journal = RepoJournal(self.__initial_path / JOURNAL_FILENAME, self.__args.resume, deadlines) # where every repo got to (and for which due dates), for --resume
+        if self.__save_repo_stats: # every commit of every repo goes in the commit stats csv as it is read
+            self.__stats_writer = CommitStatsWriter(self.__initial_path / COMMIT_STATS_FILENAME)
+
+
+    def finish(self, only_pull: bool = True):
+        '''
+        Once the pool is done: writes the stats files and run report then prints what was cloned.
+        The run's timings only go in the report of a run's only assignment, the metrics of a manifest run can't be split by assignment
+        (its summary is in tmp/metrics.jsonl)
+        '''
+        if not self.__repos: # nothing matched, still leave an (empty) assignment folder like a normal run
+            self.setup()
+
+        self.__journal.close()
+        if self.__save_repo_stats:
+            self.__stats_writer.close()
+            num_of_lines = write_avg_insersions_file(self.__initial_path, self.__assignment_name, {name: repo_stats.average_insertions() for name, repo_stats in self.__repo_stats_dict.items()})
+            write_repo_stats_file(self.__initial_path / REPO_STATS_FILENAME, self.__assignment_name, self.__repo_stats_dict)
+
+        # snapshots with --deadlines only go in the deadline folders
+        snapshot_deadlines = self.__args.snapshot and self.__deadlines
+        num_cloned = len(next(os.walk(self.__deadlines[-1][2] if snapshot_deadlines else self.__initial_path))[1])
+        write_run_report(self.__initial_path / RUN_REPORT_FILENAME, {
+            'assignment': self.__assignment_name,
+            'date_due': self.__date_due,
+            'time_due': self.__time_due,
+            'shard': list(self.__args.shard) if self.__args.shard else None,
+            'repos': len(self.__repos),
+            'cloned': num_cloned,
+            'failed': self.__journal.count('failed'),
+            **({'metrics': METRICS.get_summary()} if only_pull else {}),
+        })
+
+        print()
+        if not snapshot_deadlines:
+            print(f'{LIGHT_GREEN}{self.__assignment_name}: {"downloaded" if self.__args.snapshot else "cloned"} {num_cloned}/{len(self.__repos)} repos into `{self.__initial_path}`.{WHITE}')
+        for date_due, time_due, snapshot_path in self.__deadlines or []:
+            print(f'{LIGHT_GREEN}Checked out {len(next(os.walk(snapshot_path))[1])}/{len(self.__repos)} repos at {date_due} {time_due} in `{snapshot_path}`.{WHITE}')
+        if self.__save_repo_stats:
+            print(f'{LIGHT_GREEN}Found average lines per commit for {num_of_lines}/{len(self.__repos)} repos.{WHITE}')
+        num_failed = self.__journal.count('failed') + self.__journal.count('listed') # listed: never got to a worker
+        if num_failed:
+            print(f'{LIGHT_RED}{num_failed} repos failed, run again with --resume to only redo those.{WHITE}')
+
+
+def iter_assignment_records(github_api: GithubApi, organization: str, pulls: list):
     '''
-    return list of all repos in an organization matching assignment name prefix and is a student specified in the specified class roster csv
+    Lists the organization once and yields (AssignmentPull, RepoRecords) one listing page at a time, as soon as each page arrives.
+    The metadata of every assignment's repos on a page is fetched in the same batched GraphQL requests
     '''
-    return [repo for repo in github_org_client.get_repos() if assignment_name in repo.name and is_student(repo, students) == True]
+    for page in github_api.iter_org_repo_pages(organization):
+        matches = [(pull, [repo for repo in page if pull.matches(repo)]) for pull in pulls]
+        repos = list({repo.name: repo for _, pull_repos in matches for repo in pull_repos}.values()) # a repo can match several prefixes (hw1, hw1-part2)
+        if not repos:
+            continue
+        with METRICS.phase('get_repo_records'):
+            records = {record.name: record for record in get_repo_records(repos, organization, github_api)}
+        for pull, pull_repos in matches:
+            pull_records = [records[repo.name] for repo in pull_repos if repo.name in records]
+            if pull_records:
+                yield pull, pull_records
+
+
+def in_shard(repo_name: str, shard: tuple) -> bool:
+    '''
+    Returns whether the repo belongs to shard (index, count), index starts at 1. Always True without a shard.
+    Uses a stable hash of the name so every machine splits the repos the same way whatever order they're listed in
+    '''
+    if not shard:
+        return True
+    index, count = shard
+    return zlib.crc32(repo_name.lower().encode()) % count == index - 1
+
+
+def write_run_report(path: Path, report: dict):
+    '''
+    Writes what a run did (assignment, due date, shard, repos queued/cloned, phase timings) to a json file
+    '''
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=4)
+
+
+def setup_output_folders(initial_path: Path, deadlines: list, update: bool, resume: bool = False):
+    '''
+    Makes parent folder for whole assignment and every deadline's snapshot folder. Raises error if file already exists and it cannot be deleted.
+    A resumed run keeps every folder, the repos it redoes replace their own clone and snapshots
+    '''
+    file_exists_handler(initial_path, update or resume or bool(deadlines))
+    for _, _, snapshot_path in deadlines or []:
+        file_exists_handler(snapshot_path, resume) # snapshots are otherwise always made fresh
+
+
+def get_repos(assignment_name: str, org_repos: list) -> list:
+    '''
+    return list of all repos in an organization matching assignment name prefix (`hw1-`, so hw10 repos aren't included).
+    org_repos is the cached organization listing from GithubApi.list_org_repos
+    '''
+    return filter_repos_by_prefix(org_repos, f'{assignment_name}-')
 
 
 def get_students(student_filename: str) -> dict:
@@ -251,24 +941,60 @@ def get_students(student_filename: str) -> dict:
     return students # return dict mapping names to github username
 
 
-def get_new_repo_name(repo: Repository, students: dict, assignment_name: str) -> str:
+class RosterIndex:
+    '''
+    Index of the class roster for one assignment, built once from get_students.
+
+    Repo names are `<assignment_name>-<github username>`, so the prefix is stripped and the rest is looked up in a dict
+    instead of checking every student against every repo (which also matched `bob` inside `bobby`).
+    '''
+    __slots__ = ['__assignment_name', '__prefix', '__students']
+
+
+    def __init__(self, students: dict, assignment_name: str):
+        self.__assignment_name = assignment_name
+        self.__prefix = f'{assignment_name}-'.lower()
+        self.__students = {github.lower(): name for github, name in students.items()} # github usernames aren't case sensitive
+
+
+    def __len__(self) -> int:
+        return len(self.__students)
+
+
+    def get_username(self, repo_name: str) -> str:
+        '''
+        Returns the (lowercase) github username of the student that owns the repo, None if the repo isn't a roster student's.
+        Only the part after `<assignment_name>-` is looked up, so `hw10-bob` or `hw2-bob` never count as `hw1-bob`
+        '''
+        repo_name = repo_name.lower()
+        if not repo_name.startswith(self.__prefix):
+            return None
+        suffix = repo_name[len(self.__prefix):]
+        return suffix if suffix in self.__students else None
+
+
+    def get_new_repo_name(self, repo_name: str) -> str:
+        '''
+        Returns repo name replacing github username sufix with student's real name, None if not a roster student's repo
+        '''
+        username = self.get_username(repo_name)
+        if username is None:
+            return None
+        return f'{self.__assignment_name}-{self.__students[username]}'
+
+
+def get_new_repo_name(repo: RepoRecord, students: RosterIndex) -> str:
     '''
     Returns repo name replacing github username sufix with student's real name
     '''
-    for student in students:
-        if student in repo.name:
-            return f'{assignment_name}-{students[student]}'
-    return False
+    return students.get_new_repo_name(repo.name) or False
 
 
-def is_student(repo: Repository, students: dict) -> bool:
+def is_student(repo: RepoRecord, students: RosterIndex) -> bool:
     '''
     Check if repo belongs to one of the students in specified class roster
     '''
-    for student in students:
-        if student in repo.name:
-            return True
-    return False
+    return students.get_username(repo.name) is not None
 
 
 def opener(file_name: str) -> bool:
@@ -282,21 +1008,24 @@ def opener(file_name: str) -> bool:
         return False
 
 
-def file_exists_handler(path):
+def file_exists_handler(path, keep_existing: bool = False):
     '''
     Attempts to remove file if it already exists attempt to remove it, if not exit with an error. If it doesn't exist, create it.
+    If keep_existing is True an existing folder is left alone so its clones can be updated.
     '''
+    if Path.is_dir(path) and keep_existing:
+        return
     if Path.is_dir(path):
         try:
             shutil.rmtree(path) # attempts to delete existing folder
             Path.mkdir(path)
         except:
-            raise FileExistsError('Assignment file already exists. Delete and re-run script.')
+            raise FileExistsError(f'File `{path}` already exists, please delete it and run again')
     else:
         Path.mkdir(path)
 
 
-def save_config(token: str, organization: Organization, use_classlist: bool, student_filename: str, output_dir: Path, save_repo_stats: str, add_timestamp:str):
+def save_config(token: str, organization: str, use_classlist: bool, student_filename: str, output_dir: Path, save_repo_stats: str, add_timestamp:str):
     '''
     Save parameters into config file to be read on future runs
     '''
@@ -352,13 +1081,16 @@ def read_config_raw() -> tuple:
     return (token, organization, use_classlist, student_filename, output_dir, save_repo_stats, add_timestamp)
 
 
-def read_config() -> tuple:
+def read_config(ask: bool = True) -> tuple:
     '''
-    Checks whether config already exists, if so and use_classlist is False, ask for class roster path
+    Checks whether config already exists, if so and use_classlist is False, ask for class roster path.
+    With ask False nothing is asked (batch runs): the saved roster is used and the config must already exist
     '''
+    if not ask and not opener(CONFIG_PATH):
+        raise ValueError(f'`{CONFIG_PATH}` not found. Run once without the batch options (--manifest, --folder/--due) to make it.')
     if opener(CONFIG_PATH): # If config already exists
         token, organization, use_classlist, student_filename, output_dir, save_repo_stats, add_timestamp = read_config_raw() # get variables
-        if use_classlist == False:
+        if use_classlist == False and ask:
             print('OPTIONAL: Enter filename of csv file containing username and name of students. To ignore, just hit `enter`')
             student_filename = input('If ignored, repo names will not be changed to match student names: ')
             if student_filename: # if class roster was entered, set in config, check if use_classlist should be updated as well
@@ -424,40 +1156,54 @@ def check_git_version():
     '''
     Check that git version is at or above min requirements for script
     '''
-    try:
-        git_version = subprocess.check_output(['git', '--version'], stderr=subprocess.PIPE).decode().strip()[12:16]
-        if float(git_version) < MIN_GIT_VERSION:
-            raise ValueError(f'Your version of git is not compatible with this script. Use version {MIN_GIT_VERSION}+.')
-    except FileNotFoundError:
-        raise NotImplementedError('git not installed on the path.')
+    if get_git_version() < parse_version(f'{MIN_GIT_VERSION:.2f}'):
+        raise ValueError(f'Your version of git is not compatible with this script. Use version {MIN_GIT_VERSION}+.')
 
 
-
-def check_pygithub_version():
+def get_git_version() -> tuple:
     '''
-    Check that PyGithub version is at or above min requirements for script
+    Returns (major, minor) of the git on the path. `git --version` is only run the first time a git binary is seen,
+    the result is cached in tmp/cache by the binary's path, size and modification time
     '''
-    version = 0.0
+    git_path = shutil.which('git')
+    if not git_path:
+        raise NotImplementedError('git not installed on the path.')
+    git_stat = os.stat(git_path)
+    key = [git_stat.st_size, git_stat.st_mtime_ns]
+    cache_path = Path(CACHE_PATH, GIT_VERSION_CACHE_FILENAME)
     try:
-        check_pygithub_version_process = subprocess.Popen(['pip', 'show', 'pygithub'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        with check_pygithub_version_process:
-            for line in iter(check_pygithub_version_process.stdout.readline, b''): # b'\n'-separated lines
-                line = line.decode().lower()
-                if 'version:' in line:
-                    version = float(line.split(': ')[1][0:4])
-            if version < MIN_PYGITHUB_VERSION:
-                raise ValueError(f'Incompatible PyGithub version. Use version {MIN_PYGITHUB_VERSION}+. Use `pip install PyGithub --upgrade` to update')
-    except FileNotFoundError:
-        raise NotImplementedError('pip not installed on the path.')
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError): # no cache yet or unreadable, rebuilt below
+        cache = dict()
+    if git_path in cache and cache[git_path]['key'] == key:
+        return tuple(cache[git_path]['version'])
+
+    version = parse_version(subprocess.check_output([git_path, '--version'], stderr=subprocess.PIPE).decode().strip().replace('git version ', ''))
+    cache[git_path] = {'key': key, 'version': version}
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, 'w') as cache_file:
+            json.dump(cache, cache_file)
+    except OSError: # only a cache, the check still passed
+        pass
+    return version
 
 
-def write_avg_insersions_file(initial_path, assignment_name):
+def parse_version(version: str) -> tuple:
     '''
-    Loop through average insertions dict created by CloneRepoThreads and write to file in assignment dir
+    Returns (major, minor) of a version string like `2.30.1` or `2.39.2.windows.1`, missing parts are 0
+    '''
+    parts = re.findall(r'\d+', version)[:2]
+    return tuple(int(part) for part in parts + ['0'] * (2 - len(parts)))
+
+
+def write_avg_insersions_file(initial_path, assignment_name, averages: dict):
+    '''
+    Loop through the given repo name -> average insertions dict of one assignment and write to file in assignment dir
     '''
     num_of_lines = 0
-    local_dict = AVG_INSERTIONS_DICT
-    local_dict = dict(sorted(local_dict.items(), key=lambda item: item[0]))
+    local_dict = dict(sorted(averages.items(), key=lambda item: item[0]))
     with open(initial_path / AVERAGE_LINES_FILENAME, 'w') as avgLinesFile:
         avgLinesFile.write(f'{assignment_name}\n\n')
         for repo_name in local_dict:
@@ -512,93 +1258,191 @@ def get_time_due() -> str:
     
     return time_due
 
+def get_time_folder(date_due: str, time_due: str) -> str:
+    '''
+    Returns the due date formatted for folder names (github classroom styled)
+    '''
+    time_format = datetime.strptime(f'{date_due} {time_due}', '%Y-%m-%d %H:%M') # convert inputs to date time
+    return datetime.strftime(time_format, '%m-%d-%Y-%H-%M-%S')
+
+
+def parse_deadline(deadline: str) -> tuple:
+    '''
+    Converts a `yyyy-mm-dd hh:mm` command line deadline to (date due, time due)
+    '''
+    if not re.match(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}$', deadline.strip()):
+        raise argparse.ArgumentTypeError(f'deadline `{deadline}` not in the correct format (yyyy-mm-dd hh:mm, 24hr)')
+    return tuple(deadline.strip().split(' '))
+
+
+def parse_shard(shard: str) -> tuple:
+    '''
+    Converts an `i/n` command line shard to (index, count), index from 1 to n
+    '''
+    match = re.match(r'^(\d+)/(\d+)$', shard.strip())
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f'shard `{shard}` not in the correct format (i/n with 1 <= i <= n, e.g. 1/3)')
+    return (int(match.group(1)), int(match.group(2)))
+
+
+def read_manifest(manifest_path: Path) -> list:
+    '''
+    Reads a batch manifest and returns [(assignment name, [(date due, time due), ...], sparse paths or None)] in file order.
+
+    CSV: an `assignment,deadlines` header then one assignment per line, several deadlines separated by `;`.
+    An optional `paths` column lists the graded paths to check out (see --sparse), also separated by `;`
+        assignment,deadlines,paths
+        hw1,2022-02-01 23:59,
+        hw2,2022-02-08 23:59;2022-02-10 23:59,src;tests
+    YAML (.yml/.yaml, needs PyYAML): assignment name -> deadline, list of deadlines or {deadlines: ..., paths: [...]}
+        hw1: 2022-02-01 23:59
+        hw2: {deadlines: [2022-02-08 23:59, 2022-02-10 23:59], paths: [src, tests]}
+    '''
+    if manifest_path.suffix.lower() in ('.yml', '.yaml'):
+        try:
+            import yaml # optional, only needed for yaml manifests
+        except ImportError:
+            raise NotImplementedError('PyYAML is needed to read yaml manifests. Use `pip install pyyaml` or write the manifest as a csv.')
+        with open(manifest_path) as manifest_file:
+            text = manifest_file.read()
+        root = yaml.compose(text, Loader=yaml.SafeLoader) # safe_load keeps only the last of repeated keys, so they're looked for first
+        names = [key.value for key, _ in root.value] if isinstance(root, yaml.MappingNode) else []
+        for name in names:
+            if names.count(name) > 1:
+                raise ValueError(f'Manifest `{manifest_path}`: {name} is listed more than once.')
+        entries = yaml.safe_load(text) or dict()
+        if not isinstance(entries, dict):
+            raise ValueError(f'Manifest `{manifest_path}` should map assignment names to deadlines.')
+        entries = [(str(name), value if isinstance(value, dict) else {'deadlines': value}) for name, value in entries.items()]
+        entries = [(name, value.get('deadlines') or [], value.get('paths') or []) for name, value in entries]
+        entries = [(name, deadlines if isinstance(deadlines, list) else [deadlines], paths if isinstance(paths, list) else [paths]) for name, deadlines, paths in entries]
+    else:
+        with open(manifest_path, newline='') as manifest_file:
+            csv_reader = csv.DictReader(manifest_file)
+            if not csv_reader.fieldnames or not {'assignment', 'deadlines'} <= {field.strip().lower() for field in csv_reader.fieldnames}:
+                raise ValueError(f'Manifest `{manifest_path}` needs an `assignment,deadlines` header.')
+            rows = [{key.strip().lower(): value for key, value in row.items() if key} for row in csv_reader]
+        entries = [(row['assignment'].strip(), (row['deadlines'] or '').split(';'), (row.get('paths') or '').split(';')) for row in rows if (row['assignment'] or '').strip()]
+
+    manifest = []
+    for assignment_name, deadlines, paths in entries:
+        if any(assignment_name == name for name, _, _ in manifest): # both would write the same output folder
+            raise ValueError(f'Manifest `{manifest_path}`: {assignment_name} is listed more than once.')
+        try:
+            deadline_list = [parse_deadline(str(deadline)) for deadline in deadlines if str(deadline).strip()]
+        except argparse.ArgumentTypeError as e:
+            raise ValueError(f'Manifest `{manifest_path}`, {assignment_name}: {e}')
+        if not deadline_list:
+            raise ValueError(f'Manifest `{manifest_path}`: no deadline given for {assignment_name}.')
+        manifest.append((assignment_name, deadline_list, [str(path).strip() for path in paths if str(path).strip()] or None))
+    if not manifest:
+        raise ValueError(f'Manifest `{manifest_path}` has no assignments.')
+    return manifest
+
+
+def parse_args(args: list = None) -> argparse.Namespace:
+    '''
+    Parse command line options. Anything not given here is read from the config file or asked for
+    '''
+    parser = argparse.ArgumentParser(description='Clone all or some repositories of an assignment in a Github Organization.')
+    parser.add_argument('-w', '--workers', type=int, default=MAX_WORKERS, help=f'number of repos cloned at the same time (default: {MAX_WORKERS})')
+    parser.add_argument('-r', '--reference', action='store_true', help=f'keep a local copy of the starter code in {REFERENCE_REPOS_PATH} and have clones borrow its objects instead of storing their own')
+    parser.add_argument('-s', '--shallow', type=int, nargs='?', const=SHALLOW_WINDOW_DAYS, metavar='DAYS', help=f'only fetch DAYS days of history before the due date (default: {SHALLOW_WINDOW_DAYS}), more is fetched if needed. Average lines only covers that window')
+    batch = parser.add_mutually_exclusive_group()
+    batch.add_argument('-d', '--deadlines', type=parse_deadline, nargs='+', metavar='"DATE TIME"', help='clone every repo once into <assignment>-repos and check it out at each deadline ("yyyy-mm-dd hh:mm") in its own <assignment>-<deadline> folder')
+    batch.add_argument('-m', '--manifest', type=Path, metavar='FILE', help='pull every assignment of a csv/yaml manifest (assignment -> deadline(s)) in one run without asking for anything, sharing one org listing and worker pool')
+    parser.add_argument('-e', '--engine', choices=['threads', 'async'], default='threads', help='run repos on worker threads (default) or as asyncio tasks on one thread')
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N', help='only clone this machine\'s share of the repos (shard I of N, split by a hash of the repo name) into a `-shard-I-of-N` folder. Combine the shards\' stats with mergeShards.py')
+    parser.add_argument('--sparse', nargs='+', metavar='PATH', help='only check out these paths at the due date (folders ending in `/` like `src/ tests/`, or patterns like `*.py`), the rest of the repo stays out of the folder. A manifest\'s `paths` column overrides it per assignment')
+    parser.add_argument('--snapshot', action='store_true', help='download only the files at the due date (Github tarballs) instead of cloning, no git repo is made. --shallow, --reference and --sparse don\'t apply')
+    parser.add_argument('--resume', action='store_true', help=f'continue an interrupted or partly failed pull into the same folder: repos its {JOURNAL_FILENAME} says are finished are kept, the rest are redone')
+    parser.add_argument('--measure-downloads', action='store_true', help='also record in tmp/metrics.jsonl how much every clone/fetch received (growth of its git objects, one extra git call before and after)')
+    parser.add_argument('-u', '--update', action='store_true', help='keep an existing assignment folder, fetch into repos that were already cloned and only clone missing ones')
+    return parser.parse_args(args)
+
+
 def main():
     '''
     Main function
     '''
+    args = parse_args()
     # Enable color in cmd
     if os.name == 'nt':
         os.system('color')
     # Create log file
     logging.basicConfig(level=logging.INFO, filename=LOG_FILE_PATH)
+    # Time every phase of every repo, written to tmp/metrics.jsonl
+    METRICS.start(command='cloneRepositories', measure_sizes=args.measure_downloads)
 
     # Try catch catches errors and sends them to the log file instead of outputting to console
     try:
         # Check local git version is compatible with script
         check_git_version()
-        # Check local PyGithub module version is compatible with script
-        check_pygithub_version()
-        # Read config file, if doesn't exist make one using user input.
-        token, organization, student_filename, output_dir, save_repo_stats, add_timestamp = read_config()
-
-        # Create Organization to access repos
-        git_org_client = Github(token.strip(), pool_size = MAX_THREADS).get_organization(organization.strip())
-
-        # Variables used to get proper repos
-        assignment_name = get_assignment_name()
-        date_due = get_date_due()
-        time_due = get_time_due()
-        
-        # Sets path to output directory inside assignment folder where repos will be cloned
-
-        if bool(add_timestamp):
-            time_format = datetime.strptime(f'{date_due} {time_due}', '%Y-%m-%d %H:%M') # convert inputs to date time
-            time_folder = datetime.strftime(time_format, '%m-%d-%Y-%H-%M-%S') # github classroom styled format
-            initial_path = output_dir / f"{assignment_name}-{time_folder}"
-        else:
-            initial_path = output_dir / assignment_name
+        # Read config file, if doesn't exist make one using user input. Nothing is asked in batch runs
+        token, organization, student_filename, output_dir, save_repo_stats, add_timestamp = read_config(ask=not args.manifest)
 
-        print() # new line for formatting reasons
+        # Client for the Github API, the organization's repo listing is cached in tmp/cache between runs
+        github_api = GithubApi(token)
 
-        print(f"Output directory: {initial_path}")
-        # If student roster is specified, get repos list using proper function
-        students = dict() # student dict variable do be used im main scope
-        if student_filename: # if classroom roster is specified use it
-            students = get_students(student_filename) # fill student dict
-            repos = get_repos_specified_students(assignment_name, git_org_client, students)
+        # Assignments to pull: every one of the manifest, or the one asked for
+        if args.manifest:
+            manifest = read_manifest(args.manifest)
         else:
-            repos = get_repos(assignment_name, git_org_client)
-
-        # Makes parent folder for whole assignment. Raises eror if file already exists and it cannot be deleted
-        file_exists_handler(initial_path)
-
-        threads = []
-        # goes through list of repos and clones them into the assignment's parent folder
-        for repo in repos:
-            # Create thread to handle repos and add to thread list
-            # Each thread clones a repo, sets it back to due date/time, and gets avg lines per commit
-            thread = RepoHandler(repo, assignment_name, date_due, time_due, students, bool(student_filename), initial_path, save_repo_stats)
-            threads += [thread]
-
-        # Run all clone threads
-        for thread in threads:
-            thread.start()
-
-        # Make main thread wait for all repos to be cloned, set back to due date/time, and avg lines per commit to be found
-        for thread in threads:
-            thread.join()
-
-        if save_repo_stats:
-            num_of_lines = write_avg_insersions_file(initial_path, assignment_name)
-        
+            assignment_name = get_assignment_name()
+            if args.deadlines:
+                deadline_list = args.deadlines
+            else:
+                deadline_list = [(get_date_due(), get_time_due())]
+            manifest = [(assignment_name, deadline_list, None)]
+
+        # If student roster is specified, only that roster's repos are cloned
+        students = dict()
+        if student_filename: # if classroom roster is specified use it
+            students = get_students(student_filename) # read once, indexed per assignment
+        pulls = [AssignmentPull(assignment_name, deadline_list, output_dir, bool(add_timestamp), students, bool(student_filename), save_repo_stats, args, sparse_paths) for assignment_name, deadline_list, sparse_paths in manifest]
+
+        print() # new line for formatting reasons
+        if args.manifest:
+            print(f'Pulling {len(pulls)} assignments from `{args.manifest}`: {", ".join(assignment_name for assignment_name, _, _ in manifest)}')
+        if args.snapshot and save_repo_stats:
+            print(f'{LIGHT_RED}Snapshots have no commit history, average lines per commit are skipped.{WHITE}')
+        if args.shard:
+            print(f'Shard {args.shard[0]}/{args.shard[1]}: only cloning this machine\'s share of the repos.')
+
+        pool = AsyncRepoPool(args.workers) if args.engine == 'async' else RepoWorkerPool(args.workers)
+        try:
+            # Repos are queued page by page as the listing arrives, so the first clones run while the rest of the org is listed.
+            # Every assignment shares the listing and the pool
+            for pull, records in iter_assignment_records(github_api, organization.strip(), pulls):
+                pull.queue(records, pool, github_api, organization.strip())
+        except KeyboardInterrupt:
+            pool.cancel() # don't start the repos still queued, --resume redoes them
+            raise
+        finally:
+            # Make main thread wait for all repos to be cloned, set back to due date/time, and avg lines per commit to be found
+            pool.shutdown()
+
+        for pull in pulls:
+            pull.finish(len(pulls) == 1)
         print()
         print(f'{LIGHT_GREEN}Done.{WHITE}')
-        print(f'{LIGHT_GREEN}Cloned {len(next(os.walk(initial_path))[1])}/{len(repos)} repos.{WHITE}')
-
-        if save_repo_stats:
-            print(f'{LIGHT_GREEN}Found average lines per commit for {num_of_lines}/{len(repos)} repos.{WHITE}')
+        METRICS.print_summary()
 
-    except FileNotFoundError as e: # If classroom roster file specified in config.txt isn't found.
+    except GithubApiError as e: # When the Github API can't be reached or rejects a request
+        print()
+        print(e)
+        logging.error(e)
+    except FileNotFoundError as e: # If classroom roster file specified in config.txt (or the manifest) isn't found.
         print()
-        print(f'Classroom roster `{student_filename}` not found.')
+        print(f'File `{e.filename or student_filename}` not found.' if args.manifest else f'Classroom roster `{student_filename}` not found.')
         logging.error(e)
     except FileExistsError as e: # Error thrown if parent assignment file already exists
         print()
-        print(f'ERROR: File `{initial_path}` already exists, please delete it and run again')
+        print(f'ERROR: {e}')
         logging.error(e)
     except KeyboardInterrupt as e: # When thread fails because subprocess command threw some error/exception
         print()
-        print('ERROR: Something happened during the cloning process; your repos are not at the proper timestamp. Delete the assignment folder and run again.')
+        print('ERROR: The cloning process was interrupted; some repos are not at the proper timestamp. Run again with --resume to only redo those.')
         logging.error(e)
     except ValueError as e: # When git version is incompatible w/ script
         print()
@@ -614,6 +1458,7 @@ def main():
     except Exception as e: # If anything else happens
         print(f'ERROR: Something happened. Check {LOG_FILE_PATH}')
         logging.error(e)
+    METRICS.stop()
     exit()
 
 
@@ -0,0 +1,225 @@
+import csv
+import json
+
+from datetime import datetime
+from gitRunner import stream_git, stream_git_async
+from pathlib import Path
+from threading import Lock
+from typing import NamedTuple
+'''
+Streaming per commit stats for cloned repos.
+
+Runs `git log --numstat -z` once per repo and parses it as it arrives, so repos with tens of thousands of
+commits are handled in one pass without keeping the log in memory.
+'''
+COMMIT_STATS_FILENAME = 'commitStats.csv' # One row per commit of every repo
+REPO_STATS_FILENAME = 'repoStats.json' # Totals and averages per repo
+RECORD_SEPARATOR = b'\x1e' # Starts every commit header in the log output
+FIELD_SEPARATOR = '\x1f' # Separates the fields of a commit header
+LOG_FORMAT = '%x1e%H%x1f%at%x1f%ct%x1f%an%x1f%ae' # sha, author time, commit time, author name, author email
+COMMIT_STATS_HEADER = ['repo', 'sha', 'author_date', 'commit_date', 'author', 'email', 'insertions', 'deletions', 'files_changed']
+
+
+class CommitStats(NamedTuple):
+    '''
+    Stats for one commit
+    '''
+    sha: str
+    author_time: int # unix timestamp
+    commit_time: int # unix timestamp
+    author: str
+    email: str
+    insertions: int
+    deletions: int
+    files_changed: int
+
+
+class RepoStats:
+    '''
+    Running totals over a repo's commits. Only commits that change at least one file count (merges don't have a diff)
+    '''
+    __slots__ = ['commits', 'insertions', 'deletions', 'files_changed', 'first_commit_time', 'last_commit_time']
+
+
+    def __init__(self):
+        self.commits = 0
+        self.insertions = 0
+        self.deletions = 0
+        self.files_changed = 0
+        self.first_commit_time = None
+        self.last_commit_time = None
+
+
+    def add(self, commit: CommitStats):
+        '''
+        Adds a commit to the totals
+        '''
+        if not commit.files_changed:
+            return
+        self.commits += 1
+        self.insertions += commit.insertions
+        self.deletions += commit.deletions
+        self.files_changed += commit.files_changed
+        if self.first_commit_time is None or commit.commit_time < self.first_commit_time:
+            self.first_commit_time = commit.commit_time
+        if self.last_commit_time is None or commit.commit_time > self.last_commit_time:
+            self.last_commit_time = commit.commit_time
+
+
+    def average_insertions(self) -> float:
+        '''
+        Returns average lines inserted per commit
+        '''
+        return round(self.insertions / self.commits, 2) if self.commits else 0.0
+
+
+    def average_deletions(self) -> float:
+        '''
+        Returns average lines deleted per commit
+        '''
+        return round(self.deletions / self.commits, 2) if self.commits else 0.0
+
+
+    def to_dict(self) -> dict:
+        '''
+        Returns the totals as a json serializable dict
+        '''
+        return {
+            'commits': self.commits,
+            'insertions': self.insertions,
+            'deletions': self.deletions,
+            'files_changed': self.files_changed,
+            'average_insertions': self.average_insertions(),
+            'average_deletions': self.average_deletions(),
+            'first_commit': format_timestamp(self.first_commit_time),
+            'last_commit': format_timestamp(self.last_commit_time),
+        }
+
+
+class CommitStatsWriter:
+    '''
+    Writes commit rows of every repo to one csv file. Safe to share between worker threads
+    '''
+    __slots__ = ['__file', '__writer', '__lock']
+
+
+    def __init__(self, path: Path):
+        self.__file = open(path, 'w', newline='', encoding='utf-8')
+        self.__writer = csv.writer(self.__file)
+        self.__writer.writerow(COMMIT_STATS_HEADER)
+        self.__lock = Lock()
+
+
+    def write_commit(self, repo_name: str, commit: CommitStats):
+        '''
+        Writes one commit as a row of the csv
+        '''
+        row = [repo_name, commit.sha, format_timestamp(commit.author_time), format_timestamp(commit.commit_time),
+               commit.author, commit.email, commit.insertions, commit.deletions, commit.files_changed]
+        with self.__lock:
+            self.__writer.writerow(row)
+
+
+    def close(self):
+        self.__file.close()
+
+
+class CommitStatsParser:
+    '''
+    Parses `git log -z --numstat --format=LOG_FORMAT` output chunk by chunk, as it arrives from git.
+
+    With -z the output is NUL separated: each commit is `\\x1e<header>\\0` followed by one `added\\tdeleted\\tpath\\0`
+    per file (renames are `added\\tdeleted\\t\\0old\\0new\\0`, binary files show `-` instead of line counts)
+    '''
+    __slots__ = ['__header', '__insertions', '__deletions', '__files_changed', '__skip', '__buffer']
+
+
+    def __init__(self):
+        self.__header = None # header of the commit being summed
+        self.__insertions = self.__deletions = self.__files_changed = 0
+        self.__skip = 0 # path tokens left to skip after a rename entry
+        self.__buffer = b'' # last token of the previous chunk, not complete until the next NUL arrives
+
+
+    def feed(self, chunk: bytes) -> list:
+        '''
+        Parses the next chunk of output. Returns the CommitStats of every commit it finished
+        '''
+        commits = []
+        tokens = (self.__buffer + chunk).split(b'\0')
+        self.__buffer = tokens.pop()
+        for token in tokens:
+            if self.__skip:
+                self.__skip -= 1
+            elif token.startswith(RECORD_SEPARATOR): # next commit starts, finish the previous one
+                if self.__header:
+                    commits.append(make_commit_stats(self.__header, self.__insertions, self.__deletions, self.__files_changed))
+                self.__header = token[1:].decode(errors='replace')
+                self.__insertions = self.__deletions = self.__files_changed = 0
+            else:
+                added, deleted, path = token.lstrip(b'\n').split(b'\t', 2)
+                self.__insertions += int(added) if added != b'-' else 0
+                self.__deletions += int(deleted) if deleted != b'-' else 0
+                self.__files_changed += 1
+                if not path: # rename, old and new path follow as their own tokens
+                    self.__skip = 2
+        return commits
+
+
+    def finish(self) -> list:
+        '''
+        Returns the last commit once git is done, its numstat lines can't be known to be complete before that
+        '''
+        if not self.__header:
+            return []
+        return [make_commit_stats(self.__header, self.__insertions, self.__deletions, self.__files_changed)]
+
+
+def iter_commit_stats(repo_path: Path, revision: str = 'HEAD'):
+    '''
+    Yields CommitStats for every commit reachable from revision, newest first, while git log is still running
+    '''
+    parser = CommitStatsParser()
+    for chunk in stream_git(['log', '-z', '--numstat', f'--format={LOG_FORMAT}', revision, '--'], cwd=repo_path):
+        yield from parser.feed(chunk)
+    yield from parser.finish()
+
+
+async def aiter_commit_stats(repo_path: Path, revision: str = 'HEAD'):
+    '''
+    Same as iter_commit_stats for the asyncio clone engine
+    '''
+    parser = CommitStatsParser()
+    async for chunk in stream_git_async(['log', '-z', '--numstat', f'--format={LOG_FORMAT}', revision, '--'], cwd=repo_path):
+        for commit in parser.feed(chunk):
+            yield commit
+    for commit in parser.finish():
+        yield commit
+
+
+def make_commit_stats(header: str, insertions: int, deletions: int, files_changed: int) -> CommitStats:
+    '''
+    Builds CommitStats from a commit header line and its summed numstat lines
+    '''
+    sha, author_time, commit_time, author, email = header.split(FIELD_SEPARATOR)
+    return CommitStats(sha, int(author_time), int(commit_time), author, email, insertions, deletions, files_changed)
+
+
+def format_timestamp(timestamp: int) -> str:
+    '''
+    Returns a unix timestamp as local ISO 8601 time, None stays None
+    '''
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+def write_repo_stats_file(path: Path, assignment_name: str, repo_stats: dict):
+    '''
+    Writes totals for every repo (repo name -> RepoStats) to a json file, sorted by repo name
+    '''
+    with open(path, 'w') as stats_file:
+        json.dump({
+            'assignment': assignment_name,
+            'repos': {name: repo_stats[name].to_dict() for name in sorted(repo_stats)},
+        }, stats_file, indent=4)
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import tempfile
+import time
+
+from pathlib import Path
+from typing import NamedTuple
+'''
+Runs git commands for the grading scripts.
+
+Output is collected in one go and success is decided by git's exit code, so `warning:` lines
+(e.g. about line endings) no longer fail a repo and nothing is read line by line in Python.
+The `_async` versions do the same with asyncio subprocesses for the asyncio clone engine.
+'''
+
+
+class GitResult(NamedTuple):
+    '''
+    Output of one finished git command
+    '''
+    args: list
+    returncode: int
+    stdout: str
+    stderr: str
+    duration: float # seconds the command took
+
+
+class GitError(Exception):
+    '''
+    Raised when a git command exits with a non zero code. The GitResult is kept in `result`
+    '''
+    def __init__(self, result: GitResult):
+        self.result = result
+        message = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f'exit code {result.returncode}'
+        super().__init__(f'`git {" ".join(result.args)}` failed: {message}')
+
+
+def run_git(args: list, cwd: Path = None, check: bool = True, input: bytes = None, env: dict = None) -> GitResult:
+    '''
+    Runs `git <args>` in cwd and returns its GitResult. Raises GitError (and logs stderr) if check and git failed.
+    input is sent to git's stdin, env holds extra environment variables (e.g. GIT_INDEX_FILE)
+    '''
+    start = time.perf_counter()
+    process = subprocess.run(['git', *args], cwd=cwd, input=input, stdin=None if input is not None else subprocess.DEVNULL,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, env={**os.environ, **env} if env else None)
+    result = GitResult(
+        args = list(args),
+        returncode = process.returncode,
+        stdout = process.stdout.decode(errors='replace'),
+        stderr = process.stderr.decode(errors='replace'),
+        duration = time.perf_counter() - start,
+    )
+    if check and result.returncode != 0:
+        logging.info('Subprocess: %r', result.stderr) # Log error to log file
+        raise GitError(result)
+    return result
+
+
+def get_git_dirs(repo_path: Path) -> tuple:
+    '''
+    Returns (git dir, common dir) of a repo. They're the same `.git` folder except for worktrees,
+    where `.git` is a file pointing to a per worktree folder (HEAD) and the refs live in the main repo
+    '''
+    git_dir = Path(repo_path, '.git')
+    if Path.is_file(git_dir): # worktree, file contains `gitdir: <path>`
+        with open(git_dir) as f_handle:
+            git_dir = Path(repo_path, f_handle.read().strip()[len('gitdir: '):])
+    common_dir = git_dir
+    if Path.is_file(git_dir / 'commondir'):
+        with open(git_dir / 'commondir') as f_handle:
+            common_dir = git_dir / f_handle.read().strip()
+    return (git_dir, common_dir)
+
+
+def read_symbolic_ref(repo_path: Path, ref: str) -> str:
+    '''
+    Returns what a symbolic ref file (HEAD, refs/remotes/origin/HEAD) points to, the sha if it isn't symbolic, None if missing
+    '''
+    git_dir, common_dir = get_git_dirs(repo_path)
+    ref_dir = git_dir if ref == 'HEAD' else common_dir # HEAD is per worktree, other refs are shared
+    try:
+        with open(ref_dir / ref) as f_handle:
+            value = f_handle.read().strip()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return value[len('ref: '):] if value.startswith('ref: ') else value
+
+
+def read_ref(repo_path: Path, ref: str = 'HEAD') -> str:
+    '''
+    Returns the commit sha a ref points to (following symbolic refs and packed-refs) without starting a process, None if it doesn't exist
+    '''
+    _, common_dir = get_git_dirs(repo_path)
+    for _ in range(5): # symbolic refs can point to other symbolic refs, don't loop forever
+        value = read_symbolic_ref(repo_path, ref)
+        if value is None and ref.startswith('refs/'): # not a loose ref, look for it in packed-refs
+            try:
+                with open(common_dir / 'packed-refs') as f_handle:
+                    for line in f_handle:
+                        if line.rstrip('\n').endswith(f' {ref}') and not line.startswith(('#', '^')):
+                            return line.split(' ', 1)[0]
+            except FileNotFoundError:
+                pass
+            return None
+        if value is None or not value.startswith('refs/'):
+            return value
+        ref = value
+    return None
+
+
+def read_origin_head(repo_path: Path) -> str:
+    '''
+    Returns the remote default branch (e.g. `origin/main`) by reading the symbolic ref git keeps for it,
+    same as `git rev-parse --abbrev-ref origin/HEAD` without starting a process. None if it isn't set
+    '''
+    ref = read_symbolic_ref(repo_path, 'refs/remotes/origin/HEAD')
+    if not ref or not ref.startswith('refs/remotes/'):
+        return None
+    return ref[len('refs/remotes/'):]
+
+
+def stream_git(args: list, cwd: Path = None, chunk_size: int = 1 << 16):
+    '''
+    Runs `git <args>` in cwd and yields its stdout in byte chunks as git writes it, so big outputs are never held in memory.
+    Raises GitError after the last chunk if git failed
+    '''
+    start = time.perf_counter()
+    # stderr goes to a temp file, an undrained pipe would stall git once it fills up (progress, warnings)
+    with tempfile.TemporaryFile() as stderr_file:
+        with subprocess.Popen(['git', *args], cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr_file) as process:
+            for chunk in iter(lambda: process.stdout.read(chunk_size), b''):
+                yield chunk
+            process.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+    if process.returncode != 0:
+        result = GitResult(list(args), process.returncode, '', stderr.decode(errors='replace'), time.perf_counter() - start)
+        logging.info('Subprocess: %r', result.stderr) # Log error to log file
+        raise GitError(result)
+
+
+async def run_git_async(args: list, cwd: Path = None, check: bool = True, input: bytes = None, env: dict = None) -> GitResult:
+    '''
+    Same as run_git but awaits git with an asyncio subprocess so one thread can drive many of them.
+    If the awaiting task is cancelled git is killed, nothing is left running
+    '''
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec('git', *args, cwd=cwd, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, env={**os.environ, **env} if env else None,
+                                                   start_new_session=os.name != 'nt')
+    try:
+        stdout, stderr = await process.communicate(input)
+    except asyncio.CancelledError:
+        kill_process(process)
+        await process.wait()
+        raise
+    result = GitResult(
+        args = list(args),
+        returncode = process.returncode,
+        stdout = stdout.decode(errors='replace'),
+        stderr = stderr.decode(errors='replace'),
+        duration = time.perf_counter() - start,
+    )
+    if check and result.returncode != 0:
+        logging.info('Subprocess: %r', result.stderr) # Log error to log file
+        raise GitError(result)
+    return result
+
+
+async def stream_git_async(args: list, cwd: Path = None, chunk_size: int = 1 << 16):
+    '''
+    Same as stream_git but with an asyncio subprocess, yields stdout chunks as git writes them.
+    git is killed if the consumer stops early or is cancelled
+    '''
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec('git', *args, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                   start_new_session=os.name != 'nt')
+    stderr_task = asyncio.ensure_future(process.stderr.read()) # read alongside stdout so a full stderr pipe can't stall git
+    try:
+        while True:
+            chunk = await process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        stderr = await stderr_task
+        await process.wait()
+    except BaseException: # cancelled or generator closed before git finished
+        stderr_task.cancel()
+        kill_process(process)
+        await process.wait()
+        raise
+    if process.returncode != 0:
+        result = GitResult(list(args), process.returncode, '', stderr.decode(errors='replace'), time.perf_counter() - start)
+        logging.info('Subprocess: %r', result.stderr) # Log error to log file
+        raise GitError(result)
+
+
+def kill_process(process):
+    '''
+    Kills a process started by the `_async` functions that may have already exited. Outside Windows git runs in its own
+    process group, so helpers it started (remote-https, index-pack) are killed with it and don't keep its pipes open
+    '''
+    try:
+        if os.name == 'nt':
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,448 @@
+import bisect
+import json
+import logging
+import os
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from datetime import datetime, timezone
+from pathlib import Path
+from runMetrics import METRICS
+from threading import Lock
+from typing import NamedTuple
+'''
+Small Github API client used to get repo metadata in bulk instead of one PyGithub request per repo.
+
+Requests are paced with a token bucket and the X-RateLimit headers, rate limited requests (403/429) wait and
+are retried, and several tokens (comma separated) are rotated to raise the rate limit.
+Point GITHUB_API_URL at a local server to run against a fake API.
+'''
+GITHUB_API_URL = os.environ.get('GITHUB_API_URL', 'https://api.github.com') # REST root, GraphQL lives at /graphql under it
+GRAPHQL_BATCH_SIZE = 50 # Repos looked up per GraphQL request
+REQUEST_TIMEOUT = 30 # Seconds before a request to the API is abandoned
+REPOS_PER_PAGE = 100 # Max page size the REST API allows
+CACHE_PATH = 'tmp/cache' # On disk copies of org repo listings, revalidated with ETags every run
+REQUESTS_PER_SECOND = 10 # Steady request rate per token, Github asks clients not to hammer the API
+REQUEST_BURST = 10 # Requests a token can send back to back before being paced
+DOWNLOADS_PER_SECOND = 50 # Tarball downloads are paced apart from API calls (mostly streaming from Github's download host)
+DOWNLOAD_BURST = 50
+PACING = {'api': (REQUESTS_PER_SECOND, REQUEST_BURST), 'download': (DOWNLOADS_PER_SECOND, DOWNLOAD_BURST)} # pace -> (per second, burst)
+LOW_RATE_LIMIT = 100 # Below this many requests left, the rest are spread evenly until the limit resets
+SECONDARY_LIMIT_WAIT = float(os.environ.get('GITHUB_SECONDARY_LIMIT_WAIT', 60)) # Seconds to wait after a secondary rate limit without Retry-After, doubles every retry
+MAX_RETRIES = 5 # Rate limited requests are retried this many times before giving up
+
+# One aliased block of this is added to the query per repo. Commit count is the history of the default branch
+REPO_FIELDS = '''
+    name
+    url
+    createdAt
+    pushedAt
+    diskUsage
+    templateRepository { nameWithOwner url }
+    defaultBranchRef { name target { ... on Commit { history(first: 0) { totalCount } } } }
+'''
+
+# Same for the commit at a due date, $until is shared by the whole query
+COMMIT_AT_FIELDS = '''
+    name
+    defaultBranchRef { target { ... on Commit { history(first: 1, until: $until) { nodes { oid } } } } }
+'''
+
+
+class GithubApiError(Exception):
+    '''
+    Raised when the Github API returns an error or can't be reached
+    '''
+
+
+class RepoRecord(NamedTuple):
+    '''
+    Plain metadata for one repo, everything RepoHandler needs without going back to the API
+    '''
+    name: str
+    clone_url: str
+    created_at: datetime # UTC without tzinfo, same as PyGithub
+    default_branch: str # None if the repo is empty
+    commit_count: int
+    pushed_at: datetime # UTC without tzinfo, None if never pushed
+    size: int # KB on Github
+    template_full_name: str = None # owner/name of the template the repo was generated from, None if it wasn't
+    template_clone_url: str = None
+
+
+class RateLimiter:
+    '''
+    Picks the token every API request is sent with and makes it wait until it can be sent without hitting a rate limit.
+
+    Each token gets a token bucket per pace (`api` calls: REQUESTS_PER_SECOND, bursts of REQUEST_BURST; tarball `download`s have
+    their own) and its remaining requests/reset time per rate limit resource (`core` for REST, `graphql`) from the last response's
+    headers. The token with a free slot and the most requests left is used. Safe to share between threads
+    '''
+    __slots__ = ['__lock', '__tokens', '__buckets', '__limits', '__last_sent']
+
+
+    def __init__(self, tokens: list):
+        self.__lock = Lock()
+        self.__tokens = tokens
+        self.__buckets = {(token, pace): (burst, time.monotonic()) for token in tokens for pace, (_, burst) in PACING.items()} # (token, pace) -> (requests available, when counted)
+        self.__limits = dict() # (token, resource) -> (requests left, unix time it resets)
+        self.__last_sent = {token: 0.0 for token in tokens} # token -> monotonic time of its last request
+
+
+    def acquire(self, resource: str, pace: str = 'api') -> str:
+        '''
+        Blocks until a request for resource can be sent and returns the token to send it with
+        '''
+        warned = False
+        while True:
+            with self.__lock:
+                token, wait = min(((token, self.__get_wait(token, resource, pace)) for token in self.__tokens),
+                                  key=lambda token_wait: (token_wait[1], -self.__get_remaining(token_wait[0], resource)))
+                if wait <= 0:
+                    self.__take(token, resource, pace)
+                    return token
+            if wait > 5 and not warned: # long waits only happen when every token is out of requests
+                print(f'Github rate limit reached, waiting {round(wait)} seconds for it to reset...')
+                logging.warning(f'Github {resource} rate limit reached, waiting {round(wait)} seconds.')
+                warned = True
+            time.sleep(min(wait, 5)) # check again regularly, another thread's response may free a token sooner
+
+
+    def update(self, token: str, resource: str, headers):
+        '''
+        Stores the rate limit a response's headers report for the token
+        '''
+        if not headers or headers.get('X-RateLimit-Remaining') is None:
+            return
+        resource = headers.get('X-RateLimit-Resource') or resource
+        with self.__lock:
+            self.__limits[(token, resource)] = (int(headers['X-RateLimit-Remaining']), float(headers.get('X-RateLimit-Reset') or 0))
+
+
+    def block(self, token: str, resource: str, seconds: float):
+        '''
+        Stops the token from being used for resource for seconds (after a secondary rate limit or Retry-After)
+        '''
+        with self.__lock:
+            self.__limits[(token, resource)] = (0, time.time() + seconds)
+
+
+    def __get_remaining(self, token: str, resource: str) -> int:
+        remaining, _ = self.__limits.get((token, resource), (None, 0))
+        return remaining if remaining is not None else 1 << 30 # unknown until the first response, assume plenty
+
+
+    def __get_wait(self, token: str, resource: str, pace: str) -> float:
+        '''
+        Seconds until token can send a request for resource, 0 if it can now
+        '''
+        now = time.time()
+        remaining, reset = self.__limits.get((token, resource), (None, 0))
+        wait = 0.0
+        if remaining is not None and reset > now:
+            if remaining <= 0: # out of requests until the reset
+                wait = reset - now + 1
+            elif remaining < LOW_RATE_LIMIT: # spread the last requests until the reset
+                wait = self.__last_sent[token] + (reset - now) / remaining - time.monotonic()
+        per_second, burst = PACING[pace]
+        available, counted = self.__buckets[(token, pace)]
+        available = min(burst, available + (time.monotonic() - counted) * per_second)
+        if available < 1:
+            wait = max(wait, (1 - available) / per_second)
+        return wait
+
+
+    def __take(self, token: str, resource: str, pace: str):
+        '''
+        Counts a request sent with token
+        '''
+        now = time.monotonic()
+        per_second, burst = PACING[pace]
+        available, counted = self.__buckets[(token, pace)]
+        self.__buckets[(token, pace)] = (min(burst, available + (now - counted) * per_second) - 1, now)
+        self.__last_sent[token] = now
+        if (token, resource) in self.__limits: # until the response says otherwise
+            remaining, reset = self.__limits[(token, resource)]
+            self.__limits[(token, resource)] = (remaining - 1, reset)
+
+
+class GithubApi:
+    '''
+    Talks to the Github REST/GraphQL API with one or more personal access tokens (comma separated)
+    '''
+    __slots__ = ['__api_url', '__limiter']
+
+
+    def __init__(self, token: str, api_url: str = GITHUB_API_URL):
+        self.__api_url = api_url.rstrip('/')
+        self.__limiter = RateLimiter([token.strip() for token in token.split(',') if token.strip()])
+
+
+    def request(self, path: str, params: dict = None, headers: dict = None) -> tuple:
+        '''
+        Sends a GET request to the REST API. Returns (status, response headers, body bytes).
+        304 Not Modified is returned like a normal response so conditional requests can be handled by the caller
+        '''
+        url = f'{self.__api_url}{path}'
+        if params:
+            url += f'?{urllib.parse.urlencode(params)}'
+        return self.send('GET', path, url, 'core', lambda token: urllib.request.Request(url, headers={
+            'Authorization': f'token {token}',
+            'Accept': 'application/vnd.github.v3+json',
+            **(headers or {}),
+        }))
+
+
+    def send(self, method: str, path: str, url: str, resource: str, make_request, read_body = None, pace: str = 'api') -> tuple:
+        '''
+        Sends the request make_request(token) builds once the rate limiter allows it. Returns (status, response headers, body bytes).
+        Rate limited requests (403/429) wait for Retry-After, the limit's reset or an increasing delay and are retried with
+        whichever token is free first. 304 Not Modified is returned like a normal response.
+        read_body(response) replaces reading the whole body into memory, the body returned is then whatever it returns.
+        pace picks the token bucket the request waits on (`api`, or `download` for tarballs)
+        '''
+        for attempt in range(MAX_RETRIES + 1):
+            token = self.__limiter.acquire(resource, pace)
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(make_request(token), timeout=REQUEST_TIMEOUT) as response:
+                    body = read_body(response) if read_body else response.read()
+                    METRICS.record_api_call(method, path, response.status, time.perf_counter() - start, response.headers)
+                    self.__limiter.update(token, resource, response.headers)
+                    return (response.status, response.headers, body)
+            except urllib.error.HTTPError as e:
+                METRICS.record_api_call(method, path, e.code, time.perf_counter() - start, e.headers)
+                self.__limiter.update(token, resource, e.headers)
+                if e.code == 304:
+                    return (304, e.headers, b'')
+                if attempt < MAX_RETRIES and self.wait_for_rate_limit(token, resource, attempt, e):
+                    continue
+                raise GithubApiError(f'Github request `{path}` failed ({e.code} {e.reason}).') from e
+            except urllib.error.URLError as e:
+                raise GithubApiError(f'Could not reach the Github API at `{self.__api_url}` ({e.reason}).') from e
+
+
+    def wait_for_rate_limit(self, token: str, resource: str, attempt: int, error: urllib.error.HTTPError) -> bool:
+        '''
+        If the error is a rate limit, blocks the token until it may be used again and returns True (the request should be retried).
+        Other 403s (no access, bad token) return False
+        '''
+        if error.code not in (403, 429):
+            return False
+        retry_after = error.headers.get('Retry-After')
+        if retry_after: # secondary rate limit with a given wait
+            self.__limiter.block(token, resource, float(retry_after))
+        elif error.headers.get('X-RateLimit-Remaining') == '0': # primary rate limit, update already blocks until the reset
+            pass
+        elif error.code == 429 or b'rate limit' in error.read().lower(): # secondary rate limit without a wait, back off exponentially
+            self.__limiter.block(token, resource, SECONDARY_LIMIT_WAIT * 2 ** attempt)
+        else:
+            return False
+        logging.warning(f'Github {resource} rate limit hit (attempt {attempt + 1}), retrying.')
+        return True
+
+
+    def get_commits_at(self, organization: str, repo_names: list, until: datetime) -> dict:
+        '''
+        Finds the newest commit on the default branch made before until (an aware datetime) of every given repo, in batched GraphQL requests.
+        Returns dict mapping repo name to commit sha, None if the repo has no commit before then. Repos Github couldn't find are left out
+        '''
+        commits = dict()
+        for start in range(0, len(repo_names), GRAPHQL_BATCH_SIZE):
+            batch = repo_names[start:start + GRAPHQL_BATCH_SIZE]
+            parameters = ', '.join(f'$n{i}: String!' for i in range(len(batch)))
+            aliases = '\n'.join(f'r{i}: repository(owner: $owner, name: $n{i}) {{{COMMIT_AT_FIELDS}}}' for i in range(len(batch)))
+            variables = {f'n{i}': name for i, name in enumerate(batch)}
+            variables['owner'] = organization
+            variables['until'] = until.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            data = self.graphql(f'query($owner: String!, $until: GitTimestamp!, {parameters}) {{\n{aliases}\n}}', variables)
+
+            for i in range(len(batch)):
+                repo = data.get(f'r{i}')
+                if repo:
+                    nodes = ((repo.get('defaultBranchRef') or {}).get('target') or {}).get('history', {}).get('nodes') or []
+                    commits[repo['name']] = nodes[0]['oid'] if nodes else None
+        return commits
+
+
+    def download_tarball(self, organization: str, repo_name: str, sha: str, read_tarball):
+        '''
+        Streams the gzipped tarball of the repo's files at sha into read_tarball(stream) without keeping it, returns what read_tarball returns.
+        Github redirects to its download host, urllib follows it. Downloads are paced apart from API calls but count against the core limit
+        '''
+        path = f'/repos/{organization}/{repo_name}/tarball/{sha}'
+        url = f'{self.__api_url}{path}'
+        return self.send('GET', path, url, 'core', lambda token: urllib.request.Request(url, headers={'Authorization': f'token {token}'}), read_tarball, 'download')[2]
+
+
+    def list_org_repos(self, organization: str) -> list:
+        '''
+        Returns every repo of the organization as a list of RepoRecords sorted by name (commit_count is None)
+        '''
+        return sorted((record for page in self.iter_org_repo_pages(organization) for record in page), key=lambda record: record.name)
+
+
+    def iter_org_repo_pages(self, organization: str):
+        '''
+        Yields the repos of the organization one listing page at a time (a list of RepoRecords, commit_count is None)
+        as soon as the page arrives, so callers can start on a page's repos while the next one is requested.
+
+        The listing is kept on disk and each page is revalidated with If-None-Match/If-Modified-Since,
+        pages Github answers with 304 Not Modified come from the cache and don't count against the rate limit.
+        Repos are listed oldest first so new repos only change the last pages.
+        '''
+        cache_file = Path(CACHE_PATH, f'{organization.lower()}-repos.json')
+        cached_pages = []
+        if Path.is_file(cache_file):
+            try:
+                with open(cache_file) as f_handle:
+                    cached_pages = json.load(f_handle)
+            except ValueError: # corrupted cache, start over
+                cached_pages = []
+
+        pages = []
+        page_number = 1
+        while True:
+            cached = cached_pages[page_number - 1] if page_number <= len(cached_pages) else None
+            headers = dict()
+            if cached and cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached and cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+
+            status, response_headers, body = self.request(f'/orgs/{organization}/repos', {
+                'type': 'all', 'sort': 'created', 'direction': 'asc', 'per_page': REPOS_PER_PAGE, 'page': page_number,
+            }, headers)
+            if status == 304:
+                # the repos are unchanged but later pages may not be: a page that was the last one when cached can be
+                # followed by new repos, so trust the 304's Link header, and without one look past a full last page
+                link = response_headers.get('Link')
+                has_next = 'rel="next"' in link if link else cached['has_next'] or len(cached['repos']) >= REPOS_PER_PAGE
+                page = {**cached, 'has_next': has_next}
+            else:
+                page = {
+                    'etag': response_headers.get('ETag'),
+                    'last_modified': response_headers.get('Last-Modified'),
+                    'has_next': 'rel="next"' in (response_headers.get('Link') or ''),
+                    # only keep the fields that are used so the cache stays small
+                    'repos': [{key: repo.get(key) for key in ('name', 'clone_url', 'created_at', 'pushed_at', 'default_branch', 'size')} for repo in json.loads(body)],
+                }
+            pages.append(page)
+            yield [make_repo_record_from_listing(repo) for repo in page['repos']]
+            if not page['has_next']:
+                break
+            page_number += 1
+
+        # only saved once every page was read, a partial listing would look complete next run
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_file, 'w') as f_handle:
+            json.dump(pages, f_handle)
+
+
+    def graphql(self, query: str, variables: dict = None) -> dict:
+        '''
+        Runs a GraphQL query and returns its `data`. Errors for single aliases (e.g. repo not found) only leave that alias as None
+        '''
+        body = json.dumps({'query': query, 'variables': variables or {}}).encode()
+        for attempt in range(MAX_RETRIES + 1):
+            token_used = []
+            def make_request(token: str) -> urllib.request.Request:
+                token_used.append(token)
+                return urllib.request.Request(f'{self.__api_url}/graphql', data=body, method='POST', headers={
+                    'Authorization': f'bearer {token}',
+                    'Content-Type': 'application/json',
+                })
+            _, headers, response = self.send('POST', '/graphql', f'{self.__api_url}/graphql', 'graphql', make_request)
+            result = json.loads(response)
+            # GraphQL reports its rate limit as a normal response with a RATE_LIMITED error
+            if attempt < MAX_RETRIES and any(error.get('type') == 'RATE_LIMITED' for error in result.get('errors', [])):
+                if headers.get('X-RateLimit-Remaining') != '0': # no reset time to wait for, back off
+                    self.__limiter.block(token_used[-1], 'graphql', SECONDARY_LIMIT_WAIT * 2 ** attempt)
+                logging.warning(f'Github graphql rate limit hit (attempt {attempt + 1}), retrying.')
+                continue
+            break
+
+        if not result.get('data'): # whole query failed (bad token, syntax error...)
+            messages = '; '.join(error.get('message', '') for error in result.get('errors', []))
+            raise GithubApiError(f'Github GraphQL request failed: {messages}')
+        return result['data']
+
+
+    def get_repo_records(self, organization: str, repo_names: list) -> dict:
+        '''
+        Gets metadata for every given repo of the organization in batched GraphQL requests.
+        Returns dict mapping repo name to RepoRecord, repos Github couldn't find are left out
+        '''
+        records = dict()
+        for start in range(0, len(repo_names), GRAPHQL_BATCH_SIZE):
+            batch = repo_names[start:start + GRAPHQL_BATCH_SIZE]
+            # repo names go in as variables so they never need escaping
+            parameters = ', '.join(f'$n{i}: String!' for i in range(len(batch)))
+            aliases = '\n'.join(f'r{i}: repository(owner: $owner, name: $n{i}) {{{REPO_FIELDS}}}' for i in range(len(batch)))
+            variables = {f'n{i}': name for i, name in enumerate(batch)}
+            variables['owner'] = organization
+            data = self.graphql(f'query($owner: String!, {parameters}) {{\n{aliases}\n}}', variables)
+
+            for i in range(len(batch)):
+                repo = data.get(f'r{i}')
+                if repo:
+                    records[repo['name']] = make_repo_record(repo)
+        return records
+
+
+def filter_repos_by_prefix(repos: list, prefix: str) -> list:
+    '''
+    Returns repos whose name starts with prefix. repos has to be sorted by name (like list_org_repos returns it),
+    matches are found with a binary search instead of checking every repo in the organization
+    '''
+    names = [repo.name for repo in repos]
+    start = bisect.bisect_left(names, prefix)
+    end = start
+    while end < len(names) and names[end].startswith(prefix):
+        end += 1
+    return repos[start:end]
+
+
+def make_repo_record_from_listing(repo: dict) -> RepoRecord:
+    '''
+    Converts one repo from the REST org listing to a RepoRecord. Commit count isn't part of the listing so it is None
+    '''
+    return RepoRecord(
+        name = repo['name'],
+        clone_url = repo['clone_url'],
+        created_at = parse_timestamp(repo['created_at']),
+        default_branch = repo.get('default_branch'),
+        commit_count = None,
+        pushed_at = parse_timestamp(repo.get('pushed_at')),
+        size = repo.get('size') or 0,
+    )
+
+
+def make_repo_record(repo: dict) -> RepoRecord:
+    '''
+    Converts one repository object from a GraphQL response to a RepoRecord
+    '''
+    branch = repo.get('defaultBranchRef')
+    template = repo.get('templateRepository')
+    return RepoRecord(
+        name = repo['name'],
+        clone_url = f'{repo["url"]}.git',
+        created_at = parse_timestamp(repo['createdAt']),
+        default_branch = branch['name'] if branch else None,
+        commit_count = branch['target']['history']['totalCount'] if branch else 0,
+        pushed_at = parse_timestamp(repo.get('pushedAt')),
+        size = repo.get('diskUsage') or 0,
+        template_full_name = template['nameWithOwner'] if template else None,
+        template_clone_url = f'{template["url"]}.git' if template else None,
+    )
+
+
+def parse_timestamp(timestamp: str) -> datetime:
+    '''
+    Converts a Github ISO 8601 timestamp (e.g. 2022-01-31T23:59:00Z) to a UTC datetime without tzinfo
+    '''
+    if not timestamp:
+        return None
+    return datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ')
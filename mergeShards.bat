@@ -0,0 +1,2 @@
+python mergeShards.py %*
+pause
\ No newline at end of file
@@ -0,0 +1,146 @@
+import argparse
+import csv
+import json
+import re
+
+from cloneRepositories import LIGHT_GREEN, LIGHT_RED, RUN_REPORT_FILENAME, WHITE, write_avg_insersions_file, write_run_report
+from commitStats import COMMIT_STATS_FILENAME, REPO_STATS_FILENAME
+from pathlib import Path
+'''
+Combines the output folders of a sharded pull (`cloneRepositories.py --shard I/N` on several machines)
+into one set of stats: avgLinesInserted.txt, repoStats.json, commitStats.csv and runReport.json.
+
+Copy every shard's assignment folder (or just its stats files) to one machine and run:
+    python mergeShards.py hw1-shard-1-of-3 hw1-shard-2-of-3 hw1-shard-3-of-3
+'''
+SHARD_SUFFIX = re.compile(r'-shard-\d+-of-\d+$') # added to the assignment folder name by --shard
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Combine the stats of every shard of a sharded pull.')
+    parser.add_argument('folders', nargs='+', type=Path, help='assignment folder of every shard')
+    parser.add_argument('-o', '--output', type=Path, help='folder the combined files are written to (default: the first folder without its -shard-I-of-N suffix)')
+    args = parser.parse_args()
+
+    output_path = args.output or args.folders[0].parent / SHARD_SUFFIX.sub('', args.folders[0].resolve().name)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    reports = read_run_reports(args.folders)
+    assignment_name = reports[0]['assignment'] if reports else SHARD_SUFFIX.sub('', args.folders[0].resolve().name)
+    check_shards(reports)
+
+    repo_stats = merge_repo_stats(args.folders)
+    if repo_stats:
+        with open(output_path / REPO_STATS_FILENAME, 'w') as stats_file:
+            json.dump({'assignment': assignment_name, 'repos': {name: repo_stats[name] for name in sorted(repo_stats)}}, stats_file, indent=4)
+        write_avg_insersions_file(output_path, assignment_name, {name: stats['average_insertions'] for name, stats in repo_stats.items()})
+        num_commits = merge_commit_stats(args.folders, output_path / COMMIT_STATS_FILENAME)
+        print(f'{LIGHT_GREEN}Combined stats of {len(repo_stats)} repos ({num_commits} commits) into `{output_path}`.{WHITE}')
+
+    if reports:
+        write_run_report(output_path / RUN_REPORT_FILENAME, merge_run_reports(reports))
+        print(f'{LIGHT_GREEN}Cloned {sum(report["cloned"] for report in reports)}/{sum(report["repos"] for report in reports)} repos over {len(reports)} shards.{WHITE}')
+
+
+def read_run_reports(folders: list) -> list:
+    '''
+    Returns the run report of every folder that has one
+    '''
+    reports = []
+    for folder in folders:
+        try:
+            with open(folder / RUN_REPORT_FILENAME) as report_file:
+                reports.append(json.load(report_file))
+        except FileNotFoundError:
+            print(f'{LIGHT_RED}`{folder}` has no {RUN_REPORT_FILENAME}, only its stats are combined.{WHITE}')
+    return reports
+
+
+def check_shards(reports: list):
+    '''
+    Warns about reports from different assignments/due dates and about shards that are missing or given twice
+    '''
+    runs = {(report['assignment'], report['date_due'], report['time_due']) for report in reports}
+    if len(runs) > 1:
+        print(f'{LIGHT_RED}The folders are from different pulls: {", ".join(" ".join(run) for run in sorted(runs))}.{WHITE}')
+    counts = {report['shard'][1] for report in reports if report['shard']}
+    if len(counts) > 1:
+        print(f'{LIGHT_RED}The shards were split different ways ({", ".join(str(count) for count in sorted(counts))} shards).{WHITE}')
+    elif counts:
+        count = counts.pop()
+        indexes = [report['shard'][0] for report in reports if report['shard']]
+        missing = sorted(set(range(1, count + 1)) - set(indexes))
+        duplicates = sorted({index for index in indexes if indexes.count(index) > 1})
+        if missing:
+            print(f'{LIGHT_RED}Missing shard {", ".join(str(index) for index in missing)} of {count}, the combined stats are incomplete.{WHITE}')
+        if duplicates:
+            print(f'{LIGHT_RED}Shard {", ".join(str(index) for index in duplicates)} given more than once.{WHITE}')
+
+
+def merge_repo_stats(folders: list) -> dict:
+    '''
+    Returns repo name -> totals from every folder's repoStats.json
+    '''
+    repo_stats = dict()
+    for folder in folders:
+        try:
+            with open(folder / REPO_STATS_FILENAME) as stats_file:
+                repos = json.load(stats_file)['repos']
+        except FileNotFoundError:
+            continue
+        for name in repos:
+            if name in repo_stats:
+                print(f'{LIGHT_RED}`{name}` is in more than one shard, using the one in `{folder}`.{WHITE}')
+        repo_stats.update(repos)
+    return repo_stats
+
+
+def merge_commit_stats(folders: list, path: Path) -> int:
+    '''
+    Concatenates every folder's commitStats.csv into path (one header). Returns the number of commits
+    '''
+    num_commits = 0
+    with open(path, 'w', newline='', encoding='utf-8') as merged_file:
+        writer = csv.writer(merged_file)
+        header_written = False
+        for folder in folders:
+            try:
+                with open(folder / COMMIT_STATS_FILENAME, newline='', encoding='utf-8') as stats_file:
+                    reader = csv.reader(stats_file)
+                    header = next(reader, None)
+                    if header and not header_written:
+                        writer.writerow(header)
+                        header_written = True
+                    for row in reader:
+                        writer.writerow(row)
+                        num_commits += 1
+            except FileNotFoundError:
+                continue
+    return num_commits
+
+
+def merge_run_reports(reports: list) -> dict:
+    '''
+    Combines run reports: totals of the repo counts and phase timings (percentiles can't be combined, every shard's are kept)
+    '''
+    phases = dict()
+    for report in reports:
+        for name, stats in report.get('metrics', {}).get('phases', {}).items():
+            phase = phases.setdefault(name, {'count': 0, 'max': 0, 'total': 0})
+            phase['count'] += stats['count']
+            phase['max'] = max(phase['max'], stats['max'])
+            phase['total'] = round(phase['total'] + stats['total'], 4)
+    return {
+        'assignment': reports[0]['assignment'],
+        'date_due': reports[0]['date_due'],
+        'time_due': reports[0]['time_due'],
+        'repos': sum(report['repos'] for report in reports),
+        'cloned': sum(report['cloned'] for report in reports),
+        'failed': sum(report.get('failed', 0) for report in reports),
+        'phases': phases,
+        'shards': sorted(reports, key=lambda report: report['shard'] or [0]),
+    }
+
+
+if __name__ == '__main__':
+    main()
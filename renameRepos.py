@@ -1,6 +1,7 @@
-import csv
+import argparse
 import os
 
+from cloneRepositories import RosterIndex, get_students
 from pathlib import Path
 """
 This script is meant to rename all the cloned repositories to be the
@@ -12,12 +13,13 @@ gotten from the Github Classroom site
 DEFAULT_PATH = 'classroom_roster.csv'
 
 def main():
+    args = parse_args()
 
     # the name of the assignment to get
-    assignment_name = input("Please input the assignment name: ")
+    assignment_name = args.assignment if args.assignment is not None else input("Please input the assignment name: ")
 
     # the name of the csv file with the classlist
-    classlist = input("Please input the name of the csv file with the classlist: ")
+    classlist = args.roster if args.roster is not None else input("Please input the name of the csv file with the classlist: ")
     
     # If nothing is entered, assume the roster is the default path
     if classlist == '':     
@@ -29,33 +31,30 @@ def main():
     # updates the initial path to be the assignment folder
     assignment_path = initial_path / assignment_name
 
-    # creates lists to store the usernames and real names from clasroom_roster.csv
-    real_name_list = []
-    username_list = []
-
-    # adds the usernames and real names to the lists from the rosters
-    with open(classlist) as file:
-        filereader = csv.reader(file, delimiter=",", quotechar="\"")
-        for line in filereader:
-            real_name = line[0].strip("\'")
-            real_name_list.append(real_name)
-
-            username = line[1].strip("\"")
-            username_list.append(username)
+    # indexes the usernames and real names from clasroom_roster.csv, same as cloneRepositories.py does
+    roster = RosterIndex(get_students(classlist), assignment_name)
 
     # updates the name of the repos
-    for i in range(len(real_name_list)):
-        # gets username and creates the current name of the folder/path
-        username = username_list[i]
-        foldername = assignment_name + "-" + username
+    for foldername in os.listdir(assignment_path):
         current_path = assignment_path / foldername
 
-        # the new path name
-        new_path = assignment_path / real_name_list[i]
+        # the new path name, None if the folder doesn't belong to a student on the roster
+        new_name = roster.get_new_repo_name(foldername)
+
+        # renames the folder if it's a student's repo
+        if new_name and os.path.isdir(current_path):
+            current_path.rename(assignment_path / new_name)
+
+
+def parse_args(args: list = None) -> argparse.Namespace:
+    '''
+    Parse command line options. Anything not given here is asked for
+    '''
+    parser = argparse.ArgumentParser(description='Rename the cloned repos of an assignment to the students\' real names.')
+    parser.add_argument('-a', '--assignment', help='assignment folder (in the current directory) instead of asking for it')
+    parser.add_argument('-r', '--roster', metavar='CSV', help=f'class roster csv instead of asking for it ("" for {DEFAULT_PATH}). With both given nothing is asked')
+    return parser.parse_args(args)
+
 
-        # sees if the exists and renames if it does.
-        if os.path.isdir(current_path):
-            current_path.rename(new_path)
-        
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,89 @@
+import json
+import time
+
+from pathlib import Path
+from threading import Lock
+'''
+On disk journal of where every repo of a pull got to, so an interrupted or partly failed pull can be resumed.
+
+The journal is a JSON lines file in the assignment folder, one line per state change of a repo:
+    {"time": ..., "repo": "hw1-bob", "state": "cloned", "due": ["2022-02-01 23:59"]}
+States are `listed`, `cloned`, `rolled_back`, then `done` (with the due date `commit`) or `skipped`/`failed` (with a `reason`).
+Every line has the due date(s) of the run that wrote it, a run resumed with other due dates redoes the repos of the earlier one.
+Lines are flushed as they're written, so after a crash the journal still says which repos were finished.
+'''
+JOURNAL_FILENAME = 'journal.jsonl'
+FINISHED_STATES = ('done', 'skipped') # repos in these states aren't redone by a resumed run
+
+
+class RepoJournal:
+    '''
+    Journal of one assignment folder. Shared by every RepoHandler so writes are locked
+    '''
+    __slots__ = ['__lock', '__file', '__previous', '__states', '__due']
+
+
+    def __init__(self, path: Path, resume: bool = False, deadlines: list = None):
+        self.__lock = Lock()
+        self.__due = [f'{date_due} {time_due}' for date_due, time_due in deadlines or []] # the run's due dates, written in every line
+        self.__previous = read_journal(path) if resume else dict() # repo name -> last entry of the earlier runs
+        self.__states = {name: entry['state'] for name, entry in self.__previous.items()} # repo name -> latest state
+        self.__file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+
+    def record(self, repo_name: str, state: str, **fields):
+        '''
+        Appends a state change of a repo (extra fields like `commit` or `reason` are kept in the line)
+        '''
+        line = json.dumps({'time': round(time.time(), 3), 'repo': repo_name, 'state': state, **fields, 'due': self.__due})
+        with self.__lock:
+            self.__file.write(line + '\n')
+            self.__file.flush() # a crash right after still has the line
+            self.__states[repo_name] = state
+
+
+    def get_previous(self, repo_name: str) -> dict:
+        '''
+        Returns the last entry an earlier run wrote for the repo, None if it has none (or the run isn't resumed).
+        If that run had other due dates, its commit doesn't count: a finished repo is returned as only `cloned` so it's rolled back again
+        '''
+        previous = self.__previous.get(repo_name)
+        if previous and previous.get('due') != self.__due:
+            state = 'cloned' if previous['state'] in FINISHED_STATES + ('rolled_back',) else previous['state']
+            return {'repo': repo_name, 'state': state, 'due': previous.get('due')}
+        return previous
+
+
+    def count(self, state: str) -> int:
+        '''
+        Returns how many repos are in state right now
+        '''
+        with self.__lock:
+            return sum(1 for repo_state in self.__states.values() if repo_state == state)
+
+
+    def close(self):
+        '''
+        Closes the journal file
+        '''
+        with self.__lock:
+            self.__file.close()
+
+
+def read_journal(path: Path) -> dict:
+    '''
+    Returns repo name -> last entry of every repo in a journal file, empty if there's no journal.
+    A line cut short by a crash is ignored
+    '''
+    entries = dict()
+    try:
+        with open(path, encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry['repo']] = entry
+    except FileNotFoundError:
+        pass
+    return entries
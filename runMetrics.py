@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import time
+
+from contextlib import asynccontextmanager, contextmanager
+from gitRunner import run_git
+from pathlib import Path
+from queue import SimpleQueue
+from threading import Lock
+'''
+Timing and size measurements of a run, written as JSON lines so slow runs can be traced to a phase.
+
+Every record is one JSON object per line in METRICS_PATH. Records are put on a queue and written by a
+background thread (logging's QueueHandler/QueueListener), so worker threads never wait on the file.
+Nothing is recorded until METRICS.start is called. Download sizes are only measured if start is asked to (it runs git per phase).
+'''
+METRICS_PATH = 'tmp/metrics.jsonl' # Appended to every run, records of one run share the same `run` id
+PERCENTILES = (50, 95) # Percentiles shown in the summary besides max
+
+
+class RunMetrics:
+    '''
+    Collects the records of one run. Shared by every worker thread, the totals kept for the summary are locked
+    '''
+    __slots__ = ['__logger', '__lock', '__listener', '__path', '__run', '__durations', '__counters', '__rate_limit', '__measure_sizes']
+
+
+    def __init__(self):
+        self.__logger = logging.getLogger('gradingScripts.metrics') # Only writes to the metrics file, never to the log file
+        self.__logger.propagate = False
+        self.__lock = Lock()
+        self.__listener = None # background thread writing queued records, None when not recording
+        self.__path = None # file records are written to
+        self.__run = None # id shared by every record of the run
+        self.__durations = dict() # phase -> list of seconds, kept for the summary
+        self.__counters = dict() # counter name -> total (e.g. api calls, bytes added)
+        self.__rate_limit = None # lowest remaining Github rate limit seen
+        self.__measure_sizes = False # whether phases given a repo measure its git objects before and after
+
+
+    def start(self, path: str = METRICS_PATH, command: str = None, measure_sizes: bool = False):
+        '''
+        Starts writing records to path (JSON lines, appended) from a background thread.
+        With measure_sizes, phases given a repo path record how much its git objects grew (about what a clone or fetch received)
+        '''
+        if self.__listener:
+            return
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        file_handler = logging.FileHandler(path)
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+        queue = SimpleQueue()
+        self.__logger.addHandler(logging.handlers.QueueHandler(queue))
+        self.__logger.setLevel(logging.INFO)
+        self.__listener = logging.handlers.QueueListener(queue, file_handler)
+        self.__listener.start()
+        self.__path = path
+        self.__run = f'{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}'
+        self.__durations = dict()
+        self.__counters = dict()
+        self.__rate_limit = None
+        self.__measure_sizes = measure_sizes
+        self.record('start', command=command)
+
+
+    def stop(self):
+        '''
+        Writes the summary record then flushes and closes the metrics file. Safe to call if metrics never started
+        '''
+        listener = self.__listener
+        if not listener:
+            return
+        self.record('summary', **self.get_summary())
+        self.__listener = None
+        listener.stop() # writes everything still queued
+        for handler in list(self.__logger.handlers):
+            self.__logger.removeHandler(handler)
+        for handler in listener.handlers:
+            handler.close()
+
+
+    def record(self, event: str, **fields):
+        '''
+        Queues one JSON line `{"time", "run", "event", **fields}`. Does nothing when not recording
+        '''
+        if not self.__listener:
+            return
+        self.__logger.info(json.dumps({'time': round(time.time(), 3), 'run': self.__run, 'event': event, **fields}, default=str))
+
+
+    def add_duration(self, phase: str, seconds: float):
+        '''
+        Keeps seconds for the phase's summary line
+        '''
+        if not self.__listener:
+            return
+        with self.__lock:
+            self.__durations.setdefault(phase, []).append(seconds)
+
+
+    def add_counter(self, name: str, amount: int = 1):
+        '''
+        Adds amount to a run total shown in the summary
+        '''
+        if not self.__listener:
+            return
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + amount
+
+
+    def record_queue_wait(self, seconds: float):
+        '''
+        Records how long a job waited in the worker pool's queue before a worker picked it up
+        '''
+        self.add_duration('queue_wait', seconds)
+        self.record('queue_wait', seconds=round(seconds, 4))
+
+
+    def record_api_call(self, method: str, path: str, status: int, seconds: float, headers = None):
+        '''
+        Records one Github API request with the rate limit Github reported in its headers
+        '''
+        if not self.__listener:
+            return
+        remaining = headers.get('X-RateLimit-Remaining') if headers else None
+        if remaining is not None:
+            with self.__lock:
+                self.__rate_limit = int(remaining) if self.__rate_limit is None else min(self.__rate_limit, int(remaining))
+        self.add_duration('api', seconds)
+        self.add_counter('api_calls')
+        self.record('api', method=method, path=path, status=status, seconds=round(seconds, 4),
+                    rate_limit_remaining=remaining, rate_limit_reset=headers.get('X-RateLimit-Reset') if headers else None)
+
+
+    @contextmanager
+    def phase(self, name: str, repo: str = None, git_path: Path = None):
+        '''
+        Times the block as phase name of repo. If sizes are measured (see start) and git_path is given, the repo's git objects are
+        measured before and after (one git call each, blocking: coroutines use aphase)
+        '''
+        measure = self.__listener and self.__measure_sizes and git_path
+        size_before = get_objects_size(git_path) if measure else None
+        with self.__timed(name, repo) as fields:
+            try:
+                yield
+            finally:
+                if measure:
+                    self.__add_size(fields, size_before, get_objects_size(git_path))
+
+
+    @asynccontextmanager
+    async def aphase(self, name: str, repo: str = None, git_path: Path = None):
+        '''
+        Same as phase for coroutines, the sizes are measured on a thread so the event loop keeps running the other repos
+        '''
+        measure = self.__listener and self.__measure_sizes and git_path
+        size_before = await asyncio.to_thread(get_objects_size, git_path) if measure else None
+        with self.__timed(name, repo) as fields:
+            try:
+                yield
+            finally:
+                if measure:
+                    self.__add_size(fields, size_before, await asyncio.to_thread(get_objects_size, git_path))
+
+
+    @contextmanager
+    def __timed(self, name: str, repo: str):
+        '''
+        Times the block and records it as a phase, the block can add fields to the yielded dict
+        '''
+        fields = {'phase': name, 'repo': repo}
+        if not self.__listener:
+            yield fields
+            return
+        start = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as e:
+            fields['error'] = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            fields['seconds'] = round(seconds, 4)
+            self.add_duration(name, seconds)
+            self.record('phase', **fields)
+
+
+    def __add_size(self, fields: dict, size_before: int, size_after: int):
+        '''
+        Adds a phase's git objects size and growth (`bytes_received`) to its fields and the run total
+        '''
+        fields['objects_size'] = size_after
+        fields['bytes_received'] = size_after - size_before
+        self.add_counter('bytes_received', size_after - size_before)
+
+
+    def get_summary(self) -> dict:
+        '''
+        Returns {'phases': {phase: {count, p50, p95, max, total}}, **counters, 'rate_limit_remaining'} for the run so far
+        '''
+        with self.__lock:
+            phases = {name: {
+                'count': len(values),
+                **{f'p{percent}': round(percentile(values, percent), 4) for percent in PERCENTILES},
+                'max': round(max(values), 4),
+                'total': round(sum(values), 4),
+            } for name, values in self.__durations.items() if values}
+            return {'phases': phases, **self.__counters, 'rate_limit_remaining': self.__rate_limit}
+
+
+    def print_summary(self):
+        '''
+        Prints the p50/p95/max of every phase of the run and where the full records are
+        '''
+        if not self.__listener:
+            return
+        summary = self.get_summary()
+        if not summary['phases']:
+            return
+        width = max(len(name) for name in summary['phases'])
+        print()
+        print(f'{"Phase":<{width}}  {"Count":>6}  {"p50":>8}  {"p95":>8}  {"Max":>8}  {"Total":>9}')
+        for name, stats in summary['phases'].items():
+            print(f'{name:<{width}}  {stats["count"]:>6}  {stats["p50"]:>7.2f}s  {stats["p95"]:>7.2f}s  {stats["max"]:>7.2f}s  {stats["total"]:>8.2f}s')
+        if summary.get('api_calls'):
+            print(f'Github API calls: {summary["api_calls"]}, rate limit remaining: {summary["rate_limit_remaining"]}')
+        if summary.get('bytes_received'):
+            print(f'Received (git objects): {summary["bytes_received"] / (1 << 20):.1f} MiB')
+        print(f'Per repo timings are in `{self.__path}`.')
+
+
+def get_objects_size(repo_path: Path) -> int:
+    '''
+    Returns the size in bytes of the repo's own git objects (loose and packed, `git count-objects -v`), 0 if it isn't a repo yet.
+    Objects borrowed from a reference repo aren't counted, so this grows by about what a clone or fetch received
+    '''
+    if not Path(repo_path, '.git').exists():
+        return 0
+    count = run_git(['count-objects', '-v'], cwd=repo_path, check=False)
+    sizes = dict(line.split(': ', 1) for line in count.stdout.splitlines() if ': ' in line)
+    return (int(sizes.get('size', 0)) + int(sizes.get('size-pack', 0))) * 1024 # reported in KiB
+
+
+def percentile(values: list, percent: int) -> float:
+    '''
+    Nearest rank percentile of values (sorted or not)
+    '''
+    values = sorted(values)
+    rank = max(1, -(-percent * len(values) // 100)) # ceil without floats
+    return values[rank - 1]
+
+
+METRICS = RunMetrics() # Shared by the whole process, scripts start it in main